@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Benchmark photorger commands on a synthetic photo library.
+
+Usage:
+  bench.py [--photos=<n>...] [--size=<kb>] [--seed=<n>] [--jobs=<n>] [--cache] [--pretend] [--workdir=<path>] [--repeat=<n>] [--max-import-ms=<ms>] [<benchmark>...]
+  bench.py --run-one <benchmark> <root> [--jobs=<n>] [--cache] [--pretend]
+
+Options:
+  --photos=<n>      Number of distinct photos to generate; repeat to run at several scales [default: 1000].
+  --size=<kb>       Typical photo size in KiB [default: 256].
+  --seed=<n>        Random seed for the generated library [default: 1].
+  --jobs=<n>        Value of --jobs to run photorger with [default: 1].
+  --cache           Use the hash index and caches (they start out empty).
+  --pretend         Run with --pretend, so the tree is not modified.
+  --workdir=<path>  Folder to generate libraries in (default is a temporary folder).
+  --repeat=<n>      Number of fresh processes to time startup in [default: 10].
+  --max-import-ms=<ms>  Fail if importing photorger.cli takes longer than this (median).
+
+Benchmarks are startup, clean-single, clean-dest, move and unshadow (default is
+all of them). Each of the others runs in its own process on a fresh copy of the
+library, and reports files per second, bytes read (from /proc/self/io where
+available, otherwise photorger's own count) and peak RSS.
+
+startup times importing photorger.cli in new processes, which is most of what a
+short run from cron costs when there's nothing to do, and fails if that
+imported any of LAZY_MODULES, which only some commands need.
+"""
+
+import json
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from docopt import docopt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generate import generate  # noqa: E402
+
+
+BENCHMARKS = ['startup', 'clean-single', 'clean-dest', 'move', 'unshadow']
+
+# Modules that are slow to import and that photorger only imports in the commands
+# that use them.
+LAZY_MODULES = ['exifread', 'PIL', 'numpy', 'ctypes', 'concurrent.futures', 'csv', 'photorger.watcher']
+
+
+def read_bytes():
+    # rchar counts everything read through read() calls, whether or not it came from the page cache
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+# Run in a bare interpreter, so nothing else has been imported already
+IMPORT_SCRIPT = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+import photorger.cli
+print(json.dumps({{'seconds': time.perf_counter() - start,
+                  'loaded': [name for name in {modules!r} if name in sys.modules]}}))
+"""
+
+
+def time_startup(repeat, max_import_ms):
+    """ Time importing photorger.cli, and a whole process that does just that, in repeat
+    fresh processes, and exit with an error if it loaded any LAZY_MODULES or took
+    longer than max_import_ms. """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = IMPORT_SCRIPT.format(root=root, modules=LAZY_MODULES)
+    imports = []
+    processes = []
+    loaded = set()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', script], check=True, capture_output=True, text=True).stdout
+        processes.append(time.perf_counter() - start)
+        result = json.loads(output)
+        imports.append(result['seconds'])
+        loaded.update(result['loaded'])
+    import_ms = statistics.median(imports) * 1000
+    print(f'startup: importing photorger.cli took {import_ms:.1f} ms, and the whole process '
+          f'{statistics.median(processes) * 1000:.1f} ms (median of {repeat})')
+    if loaded:
+        sys.exit(f'startup: importing photorger.cli loaded {", ".join(sorted(loaded))}')
+    if max_import_ms is not None and import_ms > max_import_ms:
+        sys.exit(f'startup: importing photorger.cli took longer than {max_import_ms} ms')
+
+
+def run_one(benchmark, root, jobs, cache, pretend):
+    """ Run a single benchmark in this process and return its measurements. """
+    from photorger import photorger
+    from photorger.config import Config
+
+    config = Config(jobs=jobs, nocache=not cache, pretend=pretend, noclean=False)
+    if benchmark == 'clean-single':
+        config.source = root
+        fn = photorger.clean_main
+    elif benchmark == 'clean-dest':
+        config.source = os.path.join(root, 'incoming')
+        config.target = os.path.join(root, 'library')
+        fn = photorger.clean_main
+    elif benchmark == 'move':
+        config.source = os.path.join(root, 'incoming')
+        config.target = os.path.join(root, 'library')
+        fn = photorger.move_main
+    elif benchmark == 'unshadow':
+        config.source = root
+        fn = photorger.unshadow_main
+    else:
+        raise ValueError(f'Unknown benchmark {benchmark}')
+    photorger.config = config
+
+    nfiles = sum(len(files) for _, _, files in os.walk(config.source))
+    start_bytes = read_bytes()
+    start = time.perf_counter()
+    # photorger reports every action on stdout; we only want our own result there
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as sys.stdout:
+        try:
+            fn()
+        finally:
+            photorger.save_cache()
+            photorger.close_hash_index()
+            sys.stdout = stdout
+    elapsed = time.perf_counter() - start
+    end_bytes = read_bytes()
+    if start_bytes is None:
+        nbytes = sum(photorger.bytes_read.values())
+    else:
+        nbytes = end_bytes - start_bytes
+    return {
+        'benchmark': benchmark,
+        'files': nfiles,
+        'seconds': elapsed,
+        'files_per_sec': nfiles / elapsed if elapsed else 0,
+        'bytes_read': nbytes,
+        # ru_maxrss is in KiB on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def run_benchmarks(benchmarks, scales, size_kb, seed, jobs, cache, pretend, workdir):
+    print(f"{'benchmark':14s} {'photos':>7s} {'files':>7s} {'seconds':>9s} {'files/s':>9s} {'MB read':>9s} {'peak RSS MB':>12s}")
+    for photos in scales:
+        template = os.path.join(workdir, f'library-{photos}-{size_kb}-{seed}')
+        if not os.path.exists(template):
+            generate(template, photos, size_kb, seed)
+        for benchmark in benchmarks:
+            root = os.path.join(workdir, 'run')
+            shutil.rmtree(root, ignore_errors=True)
+            shutil.copytree(template, root)
+            args = [sys.executable, os.path.abspath(__file__), '--run-one', benchmark, root, f'--jobs={jobs}']
+            if cache:
+                args.append('--cache')
+            if pretend:
+                args.append('--pretend')
+            result = json.loads(subprocess.run(args, check=True, capture_output=True, text=True).stdout)
+            print(f"{benchmark:14s} {photos:7d} {result['files']:7d} {result['seconds']:9.2f} "
+                  f"{result['files_per_sec']:9.0f} {result['bytes_read'] / 1e6:9.1f} {result['peak_rss_mb']:12.1f}")
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    arguments = docopt(__doc__)
+    jobs = int(arguments['--jobs'])
+    if arguments['--run-one']:
+        result = run_one(arguments['<benchmark>'][0], arguments['<root>'], jobs, arguments['--cache'],
+                         arguments['--pretend'])
+        print(json.dumps(result))
+        return
+
+    benchmarks = arguments['<benchmark>'] or BENCHMARKS
+    for benchmark in benchmarks:
+        if benchmark not in BENCHMARKS:
+            sys.exit(f'Unknown benchmark {benchmark}; choose from {", ".join(BENCHMARKS)}')
+    if 'startup' in benchmarks:
+        max_import_ms = arguments['--max-import-ms']
+        time_startup(int(arguments['--repeat']), float(max_import_ms) if max_import_ms else None)
+        benchmarks = [benchmark for benchmark in benchmarks if benchmark != 'startup']
+        if not benchmarks:
+            return
+    scales = [int(n) for n in arguments['--photos']]
+    args = (benchmarks, scales, int(arguments['--size']), int(arguments['--seed']), jobs,
+            arguments['--cache'], arguments['--pretend'])
+    if arguments['--workdir']:
+        run_benchmarks(*args, arguments['--workdir'])
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            run_benchmarks(*args, workdir)
+
+
+if __name__ == '__main__':
+    main()
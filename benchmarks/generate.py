@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Generate a synthetic photo library for benchmarking photorger.
+
+Usage:
+  generate.py <root> [--photos=<n>] [--size=<kb>] [--seed=<n>]
+
+Options:
+  --photos=<n>  Number of distinct photos in the dated library [default: 1000].
+  --size=<kb>   Typical photo size in KiB [default: 256].
+  --seed=<n>    Random seed, so the same arguments give the same tree [default: 1].
+
+The tree has these parts:
+
+  library/YYYY/MM/DD/   JPEGs with EXIF DateTimeOriginal, already in place
+  library/misc/         duplicates of library photos in an undated folder
+  incoming/             new JPEGs with EXIF dates, files with dates in their
+                        names, duplicates of library photos, and
+                        case-shadowed names
+  samesize/             files that all have the same size but different
+                        contents, some differing only in the middle
+"""
+
+import os
+import random
+import struct
+from datetime import datetime, timedelta
+
+from docopt import docopt
+
+
+MONTHS = ['January', 'Feb', 'March', 'Apr', 'May', 'June', 'Jul', 'August', 'Sep', 'October', 'Nov', 'Dec']
+
+
+def exif_jpeg_header(created):
+    """ Build the SOI marker and an APP1 segment holding just DateTimeOriginal and
+    SubSecTimeOriginal, which is all photorger looks at. """
+    date = created.strftime('%Y:%m:%d %H:%M:%S').encode() + b'\x00'
+    subsec = f'{created.microsecond // 1000:03d}'.encode()
+    # Little-endian TIFF header, then IFD0 with a single pointer to the EXIF IFD
+    tiff = b'II*\x00' + struct.pack('<I', 8)
+    tiff += struct.pack('<H', 1) + struct.pack('<HHII', 0x8769, 4, 1, 26) + struct.pack('<I', 0)
+    # EXIF IFD at offset 26 with the date (stored at offset 56) and subseconds (inline)
+    tiff += struct.pack('<H', 2)
+    tiff += struct.pack('<HHII', 0x9003, 2, len(date), 56)
+    tiff += struct.pack('<HHI', 0x9291, 2, len(subsec) + 1) + subsec + b'\x00'
+    tiff += struct.pack('<I', 0)
+    tiff += date
+    app1 = b'Exif\x00\x00' + tiff
+    return b'\xff\xd8' + b'\xff\xe1' + struct.pack('>H', len(app1) + 2) + app1
+
+
+def randbytes(rng, n):
+    # random.Random.randbytes needs Python 3.9
+    return rng.getrandbits(8 * n).to_bytes(n, 'little') if n else b''
+
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def photo_bytes(rng, created, size):
+    header = exif_jpeg_header(created)
+    return header + randbytes(rng, max(0, size - len(header) - 2)) + b'\xff\xd9'
+
+
+def random_date(rng):
+    return datetime(2005, 1, 1) + timedelta(seconds=rng.randrange(18 * 365 * 86400),
+                                            microseconds=rng.randrange(1000) * 1000)
+
+
+def generate(root, photos=1000, size_kb=256, seed=1):
+    """ Build the tree under root and return the number of files and bytes written. """
+    rng = random.Random(seed)
+    nfiles = 0
+    nbytes = 0
+
+    def add(path, data):
+        nonlocal nfiles, nbytes
+        write_file(os.path.join(root, path), data)
+        nfiles += 1
+        nbytes += len(data)
+
+    def size():
+        return int(size_kb * 1024 * rng.uniform(0.5, 1.5))
+
+    # The dated library
+    library = []
+    for i in range(photos):
+        created = random_date(rng)
+        data = photo_bytes(rng, created, size())
+        path = f'library/{created.year}/{created.month:02d}/{created.day:02d}/IMG_{i:05d}.JPG'
+        add(path, data)
+        library.append((path, data))
+
+    # Duplicate groups: copies in an undated library folder, in other dated folders,
+    # and in incoming backups
+    for path, data in rng.sample(library, photos // 10):
+        name = os.path.basename(path)
+        add(f'library/misc/{name}', data)
+        for j in range(rng.randrange(1, 4)):
+            add(f'incoming/backup{j}/{name}', data)
+        if rng.random() < 0.3:
+            created = random_date(rng)
+            add(f'library/{created.year}/{created.month:02d}/{created.day:02d}/copy_{name}', data)
+
+    # New photos with EXIF dates in undated folders
+    for i in range(photos // 2):
+        add(f'incoming/camera/DSC_{i:05d}.JPG', photo_bytes(rng, random_date(rng), size()))
+
+    # Files with no EXIF data but with dates in their names, in each of the forms
+    # photorger recognizes
+    for i in range(photos // 4):
+        d = random_date(rng)
+        form = i % 3
+        if form == 0:
+            name = f'{d.year}{d.month:02d}{d.day:02d}_{i:05d}.mp4'
+        elif form == 1:
+            name = f'{MONTHS[d.month - 1]} {d.day}, {d.year} clip {i}.mp4'
+        else:
+            name = f'{d.day} {MONTHS[d.month - 1]} {d.year} clip {i}.mp4'
+        add(f'incoming/videos/{name}', randbytes(rng, size()))
+
+    # Case-shadowed names in the same folder
+    for i in range(photos // 20):
+        for name in [f'IMG_{i:04d}.JPG', f'img_{i:04d}.jpg', f'Img_{i:04d}.Jpg'][:rng.randrange(2, 4)]:
+            add(f'incoming/shadowed/{name}', photo_bytes(rng, random_date(rng), size()))
+
+    # Same-size non-duplicates. Half of them share their head and tail blocks and
+    # only differ in the middle, so the quick hash can't tell them apart.
+    fixed = max(size_kb * 1024, 32768)
+    head = randbytes(rng, 8192)
+    tail = randbytes(rng, 8192)
+    for i in range(photos // 5):
+        if i % 2:
+            data = head + randbytes(rng, fixed - 16384) + tail
+        else:
+            data = randbytes(rng, fixed)
+        add(f'samesize/S{i:05d}.bin', data)
+
+    return nfiles, nbytes
+
+
+def main():
+    arguments = docopt(__doc__)
+    nfiles, nbytes = generate(arguments['<root>'], int(arguments['--photos']), int(arguments['--size']),
+                              int(arguments['--seed']))
+    print(f'Generated {nfiles} files, {nbytes} bytes in {arguments["<root>"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+from .phash import hamming
+
+
+class Node:
+    __slots__ = ['h', 'items', 'children']
+
+    def __init__(self, h, item):
+        self.h = h
+        self.items = [item]
+        self.children = None  # Most nodes are leaves
+
+
+class BKTree:
+    """ Burkhard-Keller tree of hashes under Hamming distance, for finding all the hashes
+    within some distance of a given one without comparing it with every hash.
+
+    Each child of a node is keyed by its distance from the node, and by the triangle
+    inequality a search for hashes within radius r of h only has to visit children
+    whose key is within r of h's distance from the node.
+    """
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, h, item):
+        if self.root is None:
+            self.root = Node(h, item)
+            return
+        node = self.root
+        while True:
+            d = hamming(h, node.h)
+            if d == 0:
+                node.items.append(item)
+                return
+            if node.children is None:
+                node.children = {}
+            child = node.children.get(d)
+            if child is None:
+                node.children[d] = Node(h, item)
+                return
+            node = child
+
+    def search(self, h, radius):
+        """ Return (distance, item) for each item added with a hash within radius of h. """
+        results = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            d = hamming(h, node.h)
+            if d <= radius:
+                results.extend((d, item) for item in node.items)
+            if node.children is None:
+                continue
+            for k, child in node.children.items():
+                if d - radius <= k <= d + radius:
+                    stack.append(child)
+        return results
@@ -4,11 +4,13 @@
 """Photorger.
 
 Usage:
-  photorger.py info <filename>...
-  photorger.py move [--source=<sourcepath>] [--dest=<destpath>] [--noclean] [--nodeep] [--nocache] [--norecurse] [--norename] [--copy] [--pretend] [--verbose]
-  photorger.py clean [--source=<sourcepath>] [--dest=<destpath>] [--nodeep] [--nocache] [--norecurse] [--pretend]
-  photorger.py clean [--source=<sourcepath>] [--oldest|--newest] [--shortest|--longest] [--nodeep] [--nocache] [--norecurse] [--force] [--pretend]
-  photorger.py unshadow [--source=<sourcepath>] [--norecurse] [--pretend]
+  photorger.py info <filename>... [--tags=<names>] [--format=<format>] [--jobs=<n>] [--exclude=<names>] [--norecurse] [--stats=<format>] [--stats-file=<path>] [--progress]
+  photorger.py move [--source=<sourcepath>] [--dest=<destpath>] [--watch [--settle=<s>] [--rescan=<m>]] [--noclean] [--nodeep] [--nodupcheck] [--nocache] [--jobs=<n>] [--exclude=<names>] [--norecurse] [--norename] [--copy] [--copy-jobs=<n>] [--verify] [--pretend [--plan-out=<path>]] [--verbose] [--io-per-device=<n>] [--io-rate=<mb>] [--drop-cache] [--stats=<format>] [--stats-file=<path>] [--progress]
+  photorger.py clean [--source=<sourcepath>] [--dest=<destpath>] [--nodeep] [--nocache] [--rebuild-index|--verify-index] [--jobs=<n>] [--exclude=<names>] [--norecurse] [--pretend [--plan-out=<path>]] [--io-per-device=<n>] [--io-rate=<mb>] [--drop-cache] [--stats=<format>] [--stats-file=<path>] [--progress]
+  photorger.py clean [--source=<sourcepath>] [--oldest|--newest] [--shortest|--longest] [--nodeep] [--nocache] [--rebuild-index|--verify-index] [--jobs=<n>] [--exclude=<names>] [--norecurse] [--force] [--pretend [--plan-out=<path>]] [--io-per-device=<n>] [--io-rate=<mb>] [--drop-cache] [--stats=<format>] [--stats-file=<path>] [--progress]
+  photorger.py unshadow [--source=<sourcepath>] [--normalize] [--jobs=<n>] [--exclude=<names>] [--norecurse] [--pretend [--plan-out=<path>]] [--stats=<format>] [--stats-file=<path>] [--progress]
+  photorger.py similar [--source=<sourcepath>] [--distance=<n>] [--nocache] [--rebuild-index] [--jobs=<n>] [--exclude=<names>] [--norecurse] [--verbose] [--stats=<format>] [--stats-file=<path>] [--progress]
+  photorger.py apply <planfile> [--copy-jobs=<n>] [--verify] [--pretend] [--io-per-device=<n>] [--io-rate=<mb>] [--drop-cache] [--stats=<format>] [--stats-file=<path>] [--progress]
 
   photorger.py (-h | --help)
   photorger.py --version
@@ -20,28 +22,49 @@ Options:
   --target=<destpath>    Root directory of destination folder (default to current).
   --noclean              Don't remove duplicates
   --nodeep               Use just size and date or hash comparison when detecting duplicates (not content).
-  --nocache              Don't save completed item status to cache.
+  --nodupcheck           Don't look for duplicates of moved files anywhere in the dest folder, just at the destination path.
+  --nocache              Don't save completed item status, file hashes or dates to cache.
+  --rebuild-index        Discard the saved file hashes and rehash everything.
+  --verify-index         Rehash files even when the saved hash is current, and fix any that are wrong.
+  --jobs=<n>             Number of files to read at the same time [default: 1].
+  --distance=<n>         Most bits in which the perceptual hashes of images in a similar group can differ [default: 6].
+  --normalize            Make unshadow also treat names that differ only in Unicode normalization (such as NFD names from macOS) as clashing.
+  --tags=<names>         Comma-separated names of the EXIF tags for info to show, such as 'EXIF DateTimeOriginal'.
+  --format=<format>      Output format for info: text, jsonl or csv [default: text].
+  --exclude=<names>      Comma-separated names of folders to skip [default: @eaDir,#recycle].
   --norecurse            Don't recurse into child folders.
   --norename             Don't move files (with rename) if the target has a file with same name already.
+  --watch                Keep running, moving files into place as they appear in the source folder.
+  --settle=<s>           With --watch, seconds a file must be unchanged before it is moved [default: 5].
+  --rescan=<m>           With --watch, minutes between full scans of the source folder [default: 60].
   --copy                 Create copies of original files rather than moving them.
+  --copy-jobs=<n>        Number of files to copy at the same time when they can't just be renamed [default: 1].
+  --verify               Compare each copied file with the original before removing the original.
+  --io-per-device=<n>    Most files to read or write at the same time on each device; 0 for no limit [default: 0].
+  --io-rate=<mb>         Most megabytes per second to read and write in total; 0 for no limit [default: 0].
+  --drop-cache           Have the kernel drop the files read from its cache, so other programs' data stays cached.
   --pretend              Show what would be done but don't actually do it.
+  --plan-out=<path>      With --pretend, also write the actions to a file that apply can carry out later.
   --verbose              Print a result line even for files that are not moved.
   --oldest               Keep oldest file(s) in duplicate group.
   --newest               Keep newest file(s) in duplicate group.
   --shortest             Keep file(s) with shortest paths in duplicate group.
   --longest              Keep file(s) with longest paths in duplicate group.
   --force                Keep at most one instance of a duplicate set even when delete rules aren't unambiguous.
+  --stats=<format>       Report time, files, bytes and cache hits for each phase at the end, as text or json.
+  --stats-file=<path>    Write the --stats report to a file rather than stderr.
+  --progress             Print a progress line to stderr every 10 seconds.
 """
 
 import os
+import sys
 from docopt import docopt
+from . import photorger
+from .config import Config
 from .photorger import *
 
 
 def main():
-    global source, target,  pretend, copy, verbose, force
-    global newest, oldest, shortest, longest
-    global norecurse, noclean, nodeep, nocache, norename
     arguments = docopt(__doc__, version='Photorger 1.0')
     source = arguments['--source']
     target = arguments['--dest']
@@ -54,33 +77,95 @@ def main():
             target = os.getcwd()
     else :
         target = os.path.abspath(target)
-    norecurse = arguments['--norecurse']  # TODO: make sure this behaves as expected and processes right folder
-    noclean = arguments['--noclean']
-    pretend = arguments['--pretend']
-    nocache = arguments['--nocache']
-    nodeep = arguments['--nodeep']
-    norename = arguments['--norename']
-    copy = arguments['--copy']
-    verbose = arguments['--verbose']
-    newest = arguments['--newest']
-    oldest = arguments['--oldest']
-    shortest = arguments['--shortest']
-    longest = arguments['--longest']
-    force = arguments['--force']
+    stats_format = arguments['--stats']
+    if stats_format not in [None, 'text', 'json']:
+        sys.exit(f'Unknown --stats format {stats_format}; use text or json')
+    info_format = arguments['--format']
+    if info_format not in ['text', 'jsonl', 'csv']:
+        sys.exit(f'Unknown --format {info_format}; use text, jsonl or csv')
+    tag_names = [name for name in (arguments['--tags'] or '').split(',') if name] or None
+
+    # The commands read their settings from photorger.config
+    photorger.config = Config(
+        source=source,
+        target=target,
+        norecurse=arguments['--norecurse'],  # TODO: make sure this behaves as expected and processes right folder
+        noclean=arguments['--noclean'],
+        pretend=arguments['--pretend'],
+        nocache=arguments['--nocache'],
+        nodeep=arguments['--nodeep'],
+        norename=arguments['--norename'],
+        copy=arguments['--copy'],
+        verbose=arguments['--verbose'],
+        newest=arguments['--newest'],
+        oldest=arguments['--oldest'],
+        shortest=arguments['--shortest'],
+        longest=arguments['--longest'],
+        force=arguments['--force'],
+        rebuild_index=arguments['--rebuild-index'],
+        verify_index=arguments['--verify-index'],
+        jobs=int(arguments['--jobs']),
+        exclude=[name for name in arguments['--exclude'].split(',') if name],
+        progress=arguments['--progress'],
+        nodupcheck=arguments['--nodupcheck'],
+        copy_jobs=int(arguments['--copy-jobs']),
+        verify_copies=arguments['--verify'],
+        normalize=arguments['--normalize'],
+        distance=int(arguments['--distance']),
+        io_per_device=int(arguments['--io-per-device']),
+        io_rate=float(arguments['--io-rate']),
+        drop_cache=arguments['--drop-cache'],
+        settle=float(arguments['--settle']),
+        rescan=float(arguments['--rescan']),
+    )
+
+    if arguments['--plan-out']:
+        for command in ['clean', 'move', 'unshadow']:
+            if arguments[command]:
+                open_plan(arguments['--plan-out'], command)
 
     if arguments["info"]:
-        info_main(arguments['<filename>'][0])
+        info_main(arguments['<filename>'], tag_names, info_format)
 
     if arguments["clean"]:
         # Delete files from source folder that have copies in target folder
         clean_main()
+        close_hash_index()
 
     if arguments["move"]:
-        move_main()
-        save_cache() 
+        try:
+            if arguments['--watch']:
+                watch_main()
+            else:
+                move_main()
+        except KeyboardInterrupt:
+            # That's how --watch is meant to be stopped
+            if not arguments['--watch']:
+                raise
+        finally:
+            # Keep the progress made so far even if the run was interrupted
+            finish_copies()
+            save_cache()
+            close_hash_index()
 
     if arguments["unshadow"]:
-        split_main()
+        unshadow_main()
+
+    if arguments["similar"]:
+        similar_main()
+        close_hash_index()
+
+    if arguments["apply"]:
+        apply_main(arguments['<planfile>'])
+
+    close_plan()
+
+    if stats_format:
+        if arguments['--stats-file']:
+            with open(arguments['--stats-file'], 'w') as f:
+                photorger.stats.report(stats_format, f)
+        else:
+            photorger.stats.report(stats_format, sys.stderr)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,46 @@
+class Config:
+    """ The settings for a run, which cli.main builds from the command line.
+
+    Each setting defaults to what the commands do when its option isn't given;
+    source and target must be set, as there's no sensible default for them
+    (cli.main uses the current folder). Only the settings named here can be set.
+    """
+
+    source = None
+    target = None
+    norecurse = False
+    noclean = True
+    nodeep = False
+    nocache = True
+    norename = False
+    pretend = False
+    copy = False
+    verbose = False
+    newest = False
+    oldest = False
+    shortest = False
+    longest = False
+    force = False
+    rebuild_index = False
+    verify_index = False
+    jobs = 1
+    progress = False
+    nodupcheck = False
+    copy_jobs = 1
+    verify_copies = False
+    normalize = False
+    distance = 6
+    io_per_device = 0
+    io_rate = 0
+    drop_cache = False
+    settle = 5
+    rescan = 60
+    # Names of folders that are never descended into (the defaults are Synology
+    # metadata and recycle bin folders).
+    exclude = ('@eaDir', '#recycle')
+
+    def __init__(self, **settings):
+        for name, value in settings.items():
+            if not hasattr(Config, name):
+                raise TypeError(f'Unknown setting {name}')
+            setattr(self, name, value)
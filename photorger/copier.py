@@ -0,0 +1,143 @@
+import errno
+import os
+from collections import deque
+
+from .iosched import IOScheduler
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows
+    fcntl = None
+
+
+# ioctl request to make dst share src's blocks (Linux btrfs, XFS and others)
+FICLONE = 0x40049409
+
+# Errors that mean a copy method isn't supported for a pair of file systems, as
+# opposed to a problem with the particular file.
+UNSUPPORTED = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.ENOTTY, errno.EOPNOTSUPP, errno.EBADF}
+
+COPY_CHUNK = 1 << 30
+BUFFERED_CHUNK = 1 << 20
+
+
+def clone_file(fsrc, fdst, size, chunk, throttle):
+    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+def copy_file_range(fsrc, fdst, size, chunk, throttle):
+    copied = 0
+    while copied < size:
+        n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), min(chunk, size - copied))
+        if n == 0:
+            break
+        copied += n
+        throttle(2 * n)
+
+
+def sendfile(fsrc, fdst, size, chunk, throttle):
+    copied = 0
+    while copied < size:
+        n = os.sendfile(fdst.fileno(), fsrc.fileno(), copied, min(chunk, size - copied))
+        if n == 0:
+            break
+        copied += n
+        throttle(2 * n)
+
+
+def copy_buffered(fsrc, fdst, size, chunk, throttle):
+    chunk = min(chunk, BUFFERED_CHUNK)
+    while True:
+        data = fsrc.read(chunk)
+        if not data:
+            break
+        fdst.write(data)
+        throttle(2 * len(data))
+
+
+METHODS = [('clone', clone_file), ('copy_file_range', copy_file_range), ('sendfile', sendfile),
+           ('buffered', copy_buffered)]
+
+
+def available_methods():
+    names = []
+    if fcntl is not None and hasattr(fcntl, 'ioctl') and os.name == 'posix':
+        names.append('clone')
+    if hasattr(os, 'copy_file_range'):
+        names.append('copy_file_range')
+    if hasattr(os, 'sendfile'):
+        names.append('sendfile')
+    names.append('buffered')
+    return names
+
+
+class Copier:
+    """ Copies files with the fastest method that works between each pair of devices.
+
+    Methods are tried in the order reflink clone, copy_file_range, sendfile and
+    plain buffered copy; a method that fails as unsupported for a (source device,
+    dest device) pair is not tried again for that pair. With jobs above 1, copies
+    are run in background threads, with at most 2 * jobs outstanding. Copies are
+    kept within the limits of iosched, if given.
+    """
+
+    def __init__(self, jobs=1, iosched=None):
+        self.methods = {}
+        self.jobs = jobs
+        self.iosched = iosched or IOScheduler()
+        self.executor = None
+        if jobs > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            self.executor = ThreadPoolExecutor(max_workers=jobs)
+        self.pending = deque()
+
+    def copy(self, src, dst, devs):
+        """ Copy src to dst and return the name of the method used. """
+        methods = self.methods.get(devs)
+        if methods is None:
+            methods = self.methods[devs] = available_methods()
+        with open(src, 'rb') as fsrc:
+            size = os.fstat(fsrc.fileno()).st_size
+            with open(dst, 'wb') as fdst, self.iosched.using(fsrc, fdst):
+                chunk = self.iosched.chunk(COPY_CHUNK)
+                for name, fn in METHODS:
+                    if name not in methods:
+                        continue
+                    try:
+                        fn(fsrc, fdst, size, chunk, self.iosched.throttle)
+                        return name
+                    except OSError as e:
+                        if e.errno not in UNSUPPORTED or name == 'buffered':
+                            raise
+                        methods = self.methods[devs] = [m for m in methods if m != name]
+                        # Start again from a clean slate
+                        fsrc.seek(0)
+                        fdst.seek(0)
+                        fdst.truncate()
+
+    def submit(self, fn, *args):
+        """ Run fn(*args) in a background thread. Returns the results of any earlier jobs
+        that have finished, as (args, exception) pairs, waiting for the oldest if too many
+        are outstanding. """
+        self.pending.append((args, self.executor.submit(fn, *args)))
+        return self.finished(wait=len(self.pending) > 2 * self.jobs)
+
+    def finished(self, wait=False):
+        """ Return (args, exception) for the jobs that have finished, waiting for the oldest
+        one if wait is set (or for all of them if wait is 'all'). """
+        results = []
+        while self.pending:
+            args, future = self.pending[0]
+            if not (future.done() or wait):
+                break
+            self.pending.popleft()
+            results.append((args, future.exception()))
+            if wait != 'all':
+                wait = False
+        return results
+
+    def close(self):
+        results = self.finished(wait='all')
+        if self.executor is not None:
+            self.executor.shutdown()
+        return results
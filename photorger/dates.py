@@ -0,0 +1,82 @@
+import re
+from collections import namedtuple
+from datetime import datetime
+from functools import lru_cache
+
+
+# Folder names that look like a year, month or day
+year_re = re.compile('[12][90][01289][0-9]')
+month_re = re.compile('[01][0-9]')
+day_re = re.compile('[0123][0-9]')
+
+# Dates in file names. The alternatives are names of form "...YYYY-MM-DD..." or
+# "...YYYYMMDD...", "...Jan 16, 2017..." or "...January 16, 2007...", and
+# "...16 Jan, 2017..." or "...16 January, 2007...".
+name_date_re = re.compile(
+    '(?<![0-9])(?P<iy>[12][90][01289][0-9])-?(?P<im>[01][0-9])-?(?P<id>[0123][0-9])(?![0-9])'
+    '|(?<![0-9A-Za-z])(?P<mm>[A-Za-z]+)[^0-9A-Za-z]+(?P<md>[0-9]{1,2})[^A-Za-z0-9]+(?P<my>[12][90][01289][0-9])(?![0-9])'
+    '|(?<![0-9A-Za-z])(?P<dd>[0-9]{1,2})[^0-9A-Za-z]+(?P<dm>[A-Za-z]+)[^A-Za-z0-9]+(?P<dy>[12][90][01289][0-9])(?![0-9])')
+months = {k: (v+1) for v, k in enumerate(['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'])}
+
+# Number of folders whose date is remembered
+MAX_CACHED_DIRS = 65536
+
+# The date given by the YYYY/MM/DD folders in a path (0 for any that are missing),
+# and the rest of the path after them.
+PathDate = namedtuple('PathDate', ['year', 'month', 'day', 'name'])
+
+
+@lru_cache(maxsize=MAX_CACHED_DIRS)
+def folder_date(dpath):
+    """ Return (year, month, day, rest) for the innermost YYYY/MM/DD, or failing that YYYY/MM
+    or YYYY, folders in dpath, where rest is the part of dpath after them, with a
+    trailing '/' if it isn't empty. """
+    parts = dpath.split('/')
+    # The first part is before the leading '/', so can't be a folder name
+    for pattern in [(year_re, month_re, day_re), (year_re, month_re), (year_re,)]:
+        n = len(pattern)
+        for i in range(len(parts) - n, 0, -1):
+            if all(p.fullmatch(part) for p, part in zip(pattern, parts[i:i + n])):
+                ymd = [int(part) for part in parts[i:i + n]] + [0] * (3 - n)
+                return (*ymd, ''.join(part + '/' for part in parts[i + n:]))
+    return 0, 0, 0, None
+
+
+def date_from_path(fname):
+    """ Return the PathDate for fname. The name is fname itself if no date folders were found. """
+    i = fname.rfind('/')
+    year, month, day, rest = folder_date(fname[:i])
+    if rest is None:
+        return PathDate(0, 0, 0, fname)
+    return PathDate(year, month, day, rest + fname[i + 1:])
+
+
+def date_from_name(fname):
+    """ Return the first valid date found in the base name of fname, or None. """
+    name = fname[fname.rfind('/') + 1:]
+    pos = 0
+    while True:
+        m = name_date_re.search(name, pos)
+        if m is None:
+            return None
+        try:
+            if m.group('iy'):
+                return datetime(int(m.group('iy')), int(m.group('im')), int(m.group('id')))
+            if m.group('my'):
+                month = months.get(m.group('mm')[:3].lower())
+                if month:
+                    return datetime(int(m.group('my')), month, int(m.group('md')))
+            else:
+                month = months.get(m.group('dm')[:3].lower())
+                if month:
+                    return datetime(int(m.group('dy')), month, int(m.group('dd')))
+        except ValueError:
+            pass
+        # Candidates can overlap, so look again from the next character
+        pos = m.start() + 1
+
+
+def infer_dates(fnames):
+    """ Return a dict mapping each of fnames to its PathDate. Files in the same folder
+    share the work of parsing it. """
+    return {fname: date_from_path(fname) for fname in fnames}
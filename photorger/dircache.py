@@ -0,0 +1,142 @@
+import os
+
+
+# Most folder listings to keep; the oldest are dropped (and read again if needed)
+# beyond this.
+MAX_CACHED_DIRS = 4096
+
+
+def split_path(path):
+    i = path.rfind('/')
+    return path[:i], path[i + 1:]
+
+
+def split_ext(name):
+    i = name.rfind('.')
+    if i <= 0:
+        return name, ''
+    return name[:i], name[i:]
+
+
+class Listing:
+    """ The names in one folder, plus what's needed to answer case-insensitive and
+    next-free-suffix questions without scanning them. """
+    __slots__ = ['names', 'lower', 'next_suffix']
+
+    def __init__(self, names=()):
+        self.names = set()
+        self.lower = {}
+        self.next_suffix = {}
+        for name in names:
+            self.add(name)
+
+    def add(self, name):
+        if name not in self.names:
+            self.names.add(name)
+            key = name.lower()
+            self.lower[key] = self.lower.get(key, 0) + 1
+
+    def remove(self, name):
+        if name in self.names:
+            self.names.remove(name)
+            key = name.lower()
+            self.lower[key] -= 1
+            if not self.lower[key]:
+                del self.lower[key]
+
+
+class DirCache:
+    """ Cache of folder listings, each read with a single scandir the first time it is needed.
+
+    The cache must be told about every file and folder the run creates or
+    removes; changes made by anything else during the run are not seen. If it's
+    told about changes that weren't made on disk, evict must be cleared so the
+    listings that have them are never dropped and read again.
+    """
+
+    def __init__(self):
+        self.dirs = {}
+        self.evict = True
+
+    def listing(self, dpath):
+        """ Return the Listing for dpath, or None if it doesn't exist or can't be read. """
+        if dpath in self.dirs:
+            return self.dirs[dpath]
+        try:
+            with os.scandir(dpath or '/') as it:
+                listing = Listing(entry.name for entry in it)
+        except (FileNotFoundError, NotADirectoryError):
+            listing = None
+        except OSError:
+            return None  # Not cached, so it's tried again next time
+        self.store(dpath, listing)
+        return listing
+
+    def store(self, dpath, listing):
+        if self.evict and dpath not in self.dirs and len(self.dirs) >= MAX_CACHED_DIRS:
+            del self.dirs[next(iter(self.dirs))]
+        self.dirs[dpath] = listing
+
+    def clear(self):
+        """ Forget every listing, so folders are read again when next needed. """
+        self.dirs.clear()
+
+    def exists(self, path):
+        dpath, name = split_path(path)
+        listing = self.listing(dpath)
+        return listing is not None and name in listing.names
+
+    def exists_nocase(self, path):
+        dpath, name = split_path(path)
+        listing = self.listing(dpath)
+        return listing is not None and name.lower() in listing.lower
+
+    def add(self, path):
+        dpath, name = split_path(path)
+        listing = self.listing(dpath)
+        if listing is None:
+            listing = self.add_dir(dpath)
+        listing.add(name)
+
+    def add_dir(self, dpath):
+        """ Record that dpath (and any missing parents) now exists, and return its Listing. """
+        listing = self.dirs.get(dpath)
+        if listing is None:
+            listing = Listing()
+            self.store(dpath, listing)
+        if dpath:
+            self.add(dpath)
+        return listing
+
+    def appeared(self, path):
+        """ Check with a stat whether path exists even though the cache says it doesn't,
+        adding it to the cache if it does. """
+        if os.path.lexists(path):
+            self.add(path)
+            return True
+        return False
+
+    def remove(self, path):
+        dpath, name = split_path(path)
+        listing = self.dirs.get(dpath)
+        if listing is not None:
+            listing.remove(name)
+
+    def distinct_name(self, path, nocase=False):
+        """ Return path with the lowest (n) suffix that doesn't clash with a file in its folder
+        (ignoring case if nocase is set), skipping any suffixes this has already returned. """
+        dpath, name = split_path(path)
+        stem, ext = split_ext(name)
+        listing = self.listing(dpath) or Listing()
+        key = (stem, ext, nocase)
+        i = listing.next_suffix.get(key, 1)
+        while True:
+            candidate = f'{stem}({i}){ext}'
+            if nocase:
+                if candidate.lower() not in listing.lower:
+                    break
+            elif candidate not in listing.names:
+                break
+            i += 1
+        listing.next_suffix[key] = i + 1
+        return f'{dpath}/{candidate}'
@@ -0,0 +1,171 @@
+import os
+import sqlite3
+
+
+# Number of index updates to buffer before committing them to disk.
+COMMIT_INTERVAL = 1000
+
+
+class HashIndex:
+    """ Persistent map from file path to content digests, EXIF creation date and perceptual hash.
+
+    Digests are only trusted while the file's size, mtime, inode and device are
+    unchanged, and dates and perceptual hashes while its size and mtime are; otherwise the caller is
+    expected to compute them again and store the new values. Digests are passed
+    in and out as raw bytes, but kept as hex in the database. If readonly is set
+    nothing is written to disk, and an index that doesn't exist yet (or was made by
+    an older version) is treated as empty.
+    """
+
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self.pending = 0
+        self.hits = 0
+        self.misses = 0
+        self.db = None
+        if readonly and not os.path.exists(path):
+            return
+        self.db = sqlite3.connect(path)
+        if readonly:
+            tables = {row[0] for row in self.db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            columns = [row[1] for row in self.db.execute('PRAGMA table_info(hashes)')]
+            if not {'hashes', 'dates', 'phashes'} <= tables or 'partial' not in columns:
+                self.db.close()
+                self.db = None
+            return
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS hashes (
+                               path TEXT PRIMARY KEY,
+                               size INTEGER,
+                               mtime_ns INTEGER,
+                               inode INTEGER,
+                               dev INTEGER,
+                               digest TEXT,
+                               partial TEXT)''')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS dates (
+                               path TEXT PRIMARY KEY,
+                               size INTEGER,
+                               mtime_ns INTEGER,
+                               created TEXT)''')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS phashes (
+                               path TEXT PRIMARY KEY,
+                               size INTEGER,
+                               mtime_ns INTEGER,
+                               phash INTEGER)''')
+        columns = [row[1] for row in self.db.execute('PRAGMA table_info(hashes)')]
+        if 'partial' not in columns:
+            self.db.execute('ALTER TABLE hashes ADD COLUMN partial TEXT')
+
+    def lookup(self, fname, st):
+        """ Return the (digest, partial) pair for fname if its entry is current, else None.
+        Either digest may be None if it has not been computed yet. """
+        if self.db is None:
+            return None
+        row = self.db.execute('SELECT size, mtime_ns, inode, dev, digest, partial FROM hashes WHERE path = ?',
+                              (fname,)).fetchone()
+        if row is not None and row[:4] == (st.st_size, st.st_mtime_ns, st.st_ino, st.st_dev):
+            return tuple(None if h is None else bytes.fromhex(h) for h in row[4:])
+        return None
+
+    def store(self, fname, st, digest, partial):
+        if self.readonly:
+            return
+        self.db.execute('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (fname, st.st_size, st.st_mtime_ns, st.st_ino, st.st_dev,
+                         None if digest is None else digest.hex(), None if partial is None else partial.hex()))
+        self.pending += 1
+        if self.pending >= COMMIT_INTERVAL:
+            self.commit()
+
+    def lookup_date(self, fname, size, mtime_ns):
+        """ Return the ISO format creation date for fname if its entry is current, else None.
+        The date is '' if the file is known not to have one. These take the size and mtime
+        rather than a stat result so the ones from a walk can be used without a stat. """
+        if self.db is None:
+            return None
+        row = self.db.execute('SELECT size, mtime_ns, created FROM dates WHERE path = ?',
+                              (fname,)).fetchone()
+        if row is not None and row[:2] == (size, mtime_ns):
+            return row[2]
+        return None
+
+    def store_date(self, fname, size, mtime_ns, created):
+        if self.readonly:
+            return
+        self.db.execute('INSERT OR REPLACE INTO dates VALUES (?, ?, ?, ?)',
+                        (fname, size, mtime_ns, created))
+        self.pending += 1
+        if self.pending >= COMMIT_INTERVAL:
+            self.commit()
+
+    def lookup_phash(self, fname, size, mtime_ns):
+        """ Return the 64-bit perceptual hash of fname if its entry is current, else None.
+        The hash is -1 if the file is known not to be an image that can be hashed. """
+        if self.db is None:
+            return None
+        row = self.db.execute('SELECT size, mtime_ns, phash FROM phashes WHERE path = ?',
+                              (fname,)).fetchone()
+        if row is not None and row[:2] == (size, mtime_ns):
+            if row[2] is None:
+                return -1
+            # SQLite integers are signed
+            return row[2] if row[2] >= 0 else row[2] + (1 << 64)
+        return None
+
+    def store_phash(self, fname, size, mtime_ns, phash):
+        if self.readonly:
+            return
+        if phash < 0:
+            phash = None
+        elif phash >= 1 << 63:
+            phash -= 1 << 64
+        self.db.execute('INSERT OR REPLACE INTO phashes VALUES (?, ?, ?, ?)',
+                        (fname, size, mtime_ns, phash))
+        self.pending += 1
+        if self.pending >= COMMIT_INTERVAL:
+            self.commit()
+
+    def clear(self):
+        if self.readonly:
+            return
+        self.db.execute('DELETE FROM hashes')
+        self.db.execute('DELETE FROM dates')
+        self.db.execute('DELETE FROM phashes')
+        self.commit()
+
+    def prune(self, root, seen, recursive=True):
+        """ Drop entries under root that were not seen in the latest walk of root. """
+        if self.readonly:
+            return 0
+        prefix = root if root[-1] == '/' else root + '/'
+        stale = 0
+        for table in ['hashes', 'dates', 'phashes']:
+            # All paths starting with prefix sort between prefix and prefix with its
+            # trailing '/' bumped to the next character ('0').
+            rows = self.db.execute(f'SELECT path FROM {table} WHERE path >= ? AND path < ?',
+                                   (prefix, prefix[:-1] + '0')).fetchall()
+            paths = []
+            for (fname,) in rows:
+                if fname in seen:
+                    continue
+                if not recursive and fname.find('/', len(prefix)) >= 0:
+                    continue  # In a subfolder we didn't walk
+                paths.append((fname,))
+            if paths:
+                self.db.executemany(f'DELETE FROM {table} WHERE path = ?', paths)
+                self.commit()
+            stale += len(paths)
+        return stale
+
+    def commit(self):
+        if not self.readonly:
+            self.db.commit()
+        self.pending = 0
+
+    def close(self):
+        if self.db is not None:
+            self.commit()
+            self.db.close()
+            self.db = None
@@ -0,0 +1,94 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+# How far ahead of the --io-rate schedule reads can get, in seconds, so that small
+# reads don't each have to wait.
+BURST_SECONDS = 0.1
+
+# Largest read or copy chunk to use when there's a rate limit, as a fraction of a
+# second's worth of bytes, so that the limit is applied smoothly.
+CHUNK_SECONDS = 0.1
+
+
+class IOScheduler:
+    """ Keeps reading and writing file contents within limits, so photorger can share a
+    machine with other work.
+
+    per_device limits how many files (or sets of files read together) can be in
+    use at once on each device, whatever the number of threads; rate limits the
+    total bytes per second read and written; and if drop_cache is set the kernel is
+    told to drop the files' pages from its cache once we are done with them, so a
+    scan doesn't push out what everything else is using. Files are always marked
+    as being read sequentially. A zero limit means no limit.
+    """
+
+    def __init__(self, per_device=0, rate=0, drop_cache=False):
+        self.per_device = per_device
+        self.rate = rate
+        self.drop_cache = drop_cache
+        self.lock = threading.Lock()
+        self.slots = {}
+        # The time by which everything throttled so far would have been transferred at
+        # the rate limit
+        self.schedule = time.monotonic()
+
+    def slot(self, dev):
+        with self.lock:
+            if dev not in self.slots:
+                self.slots[dev] = threading.Semaphore(self.per_device)
+            return self.slots[dev]
+
+    @contextmanager
+    def using(self, *files):
+        """ Use around the reads and writes of the open files, waiting first for a slot on
+        each of their devices. """
+        slots = []
+        if self.per_device:
+            # Always taking slots in the same order means threads can't deadlock
+            slots = [self.slot(dev) for dev in sorted({os.fstat(f.fileno()).st_dev for f in files})]
+        for slot in slots:
+            slot.acquire()
+        try:
+            advise(files, 'POSIX_FADV_SEQUENTIAL')
+            yield
+        finally:
+            if self.drop_cache:
+                advise(files, 'POSIX_FADV_DONTNEED')
+            for slot in reversed(slots):
+                slot.release()
+
+    def throttle(self, n):
+        """ Account for n bytes read or written, sleeping if that puts us over the rate limit. """
+        if not self.rate or not n:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.schedule = max(self.schedule, now - BURST_SECONDS) + n / self.rate
+            delay = self.schedule - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def read(self, f, size):
+        data = f.read(size)
+        self.throttle(len(data))
+        return data
+
+    def chunk(self, size):
+        """ Return the chunk size to use for a transfer that would otherwise use size. """
+        if not self.rate:
+            return size
+        return max(1 << 16, min(size, int(self.rate * CHUNK_SECONDS)))
+
+
+def advise(files, advice):
+    if not hasattr(os, 'posix_fadvise'):
+        return  # Not on macOS or Windows
+    for f in files:
+        if not f.closed:
+            try:
+                os.posix_fadvise(f.fileno(), 0, 0, getattr(os, advice))
+            except OSError:
+                pass  # Only a hint
@@ -0,0 +1,79 @@
+import os
+import pickle
+import sqlite3
+
+
+# Number of additions to buffer before committing them to disk, which bounds
+# how much progress is lost if a run is killed.
+FLUSH_INTERVAL = 100
+
+
+class DoneJournal:
+    """ Persistent record of the files move has already dealt with.
+
+    Each path is stored with the size and mtime it had when it was recorded, and
+    only counts as done while those are unchanged. Lookups go to SQLite, so the
+    journal is never loaded into memory. If readonly is set nothing is written
+    to disk, and additions are only remembered for the rest of the run.
+    """
+
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self.added = set()
+        self.pending = 0
+        self.db = None
+        if readonly and not os.path.exists(path):
+            return
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS done (
+                               path TEXT PRIMARY KEY,
+                               size INTEGER,
+                               mtime_ns INTEGER)''')
+
+    def contains(self, fname, size, mtime_ns):
+        if fname in self.added:
+            return True
+        if self.db is None:
+            return False
+        row = self.db.execute('SELECT size, mtime_ns FROM done WHERE path = ?', (fname,)).fetchone()
+        return row is not None and row == (size, mtime_ns)
+
+    def add(self, fname):
+        if self.readonly:
+            self.added.add(fname)
+            return
+        try:
+            st = os.stat(fname)
+        except OSError:
+            return  # Moved away; there's nothing left to skip
+        self.db.execute('INSERT OR REPLACE INTO done VALUES (?, ?, ?)', (fname, st.st_size, st.st_mtime_ns))
+        self.pending += 1
+        if self.pending >= FLUSH_INTERVAL:
+            self.flush()
+
+    def discard(self, fname):
+        self.added.discard(fname)
+        if self.db is not None and not self.readonly:
+            self.db.execute('DELETE FROM done WHERE path = ?', (fname,))
+
+    def import_pickle(self, path):
+        """ Add the paths from an old-style pickled set of done paths. """
+        with open(path, 'rb') as f:
+            paths = pickle.load(f)
+        for fname in paths:
+            self.add(fname)
+        self.flush()
+
+    def flush(self):
+        if self.db is not None and not self.readonly:
+            self.db.commit()
+        self.pending = 0
+
+    def close(self):
+        self.flush()
+        if self.db is not None:
+            self.db.close()
+            self.db = None
@@ -0,0 +1,59 @@
+import io
+
+try:
+    import numpy
+except ImportError:  # Hashes are computed one at a time instead
+    numpy = None
+
+try:
+    from PIL import Image
+except ImportError:  # The similar command can't be used
+    Image = None
+
+
+# Hashes compare each pixel of a HASH_SIZE x HASH_SIZE grayscale image with its right
+# neighbour, so they have HASH_SIZE * HASH_SIZE bits.
+HASH_SIZE = 8
+
+# Size to ask JPEG decoders to scale down to while decoding, which is much faster
+# than decoding the full image and then resizing it.
+DRAFT_SIZE = (64, 64)
+
+
+def image_pixels(f):
+    """ Decode the image in file object f, and return its pixels as HASH_SIZE rows of
+    HASH_SIZE + 1 grayscale bytes, or None if it can't be decoded. """
+    try:
+        with Image.open(f) as im:
+            im.draft('L', DRAFT_SIZE)
+            return im.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR).tobytes()
+    except Exception:
+        return None
+
+
+def thumbnail_pixels(data):
+    return image_pixels(io.BytesIO(data))
+
+
+def dhash(pixels):
+    """ Return the difference hash of pixels from image_pixels, as an int. """
+    h = 0
+    width = HASH_SIZE + 1
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            i = row * width + col
+            h = (h << 1) | (pixels[i + 1] > pixels[i])
+    return h
+
+
+def dhash_batch(batch):
+    """ Return the difference hashes of a list of pixel strings from image_pixels. """
+    if numpy is None or not batch:
+        return [dhash(pixels) for pixels in batch]
+    a = numpy.frombuffer(b''.join(batch), dtype=numpy.uint8).reshape(len(batch), HASH_SIZE, HASH_SIZE + 1)
+    bits = numpy.packbits(a[:, :, 1:] > a[:, :, :-1], axis=-1).reshape(len(batch), -1)
+    return [int.from_bytes(row.tobytes(), 'big') for row in bits]
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
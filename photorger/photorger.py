@@ -1,69 +1,140 @@
-import glob
+import errno
 import hashlib
+import io
+import json
 import os
-import pickle
-import re
 import sys
+import time
+import unicodedata
+from collections import deque
+from contextlib import ExitStack
 from datetime import datetime
-from pathlib import Path
-from shutil import copyfile
-
-import exifread
-
-
-# Command-line settings
-source = os.getcwd()
-target = os.getcwd()
-noclean = True
-nodeep = False
-nocache = True
-norename = False
-pretend = False
-copy = False
-verbose = False
-newest = False
-oldest = False
-shortest = False
-longest = False
-force = False
-
-# use_rename means use os.rename rather than file copy. We default to this and turn
-# it off if rename fails, which may be because the source and destination are on 
-# different file systems so copy is the only option.
-use_rename = True
-
-# RegExps used to get date info from file paths
-# These would need some fixing for Windows
-path_re1=re.compile('^(.*)/([12][90][01289][0-9])/([01][0-9])/([0123][0-9])/(.*)$')
-path_re2=re.compile('^(.*)/([12][90][01289][0-9])/([01][0-9])/(.*)$')
-path_re3=re.compile('^(.*)/([12][90][01289][0-9])/(.*)$')
-
-# Load the cache
-cachefile = target + '/.photorger.cache'
-done = set()
-if os.path.exists(cachefile):
-  with open(cachefile, 'rb') as f:
-    done = pickle.load(f)
+
+from .config import Config
+from .copier import Copier
+from .dates import date_from_name, date_from_path, infer_dates
+from .dircache import DirCache, Listing
+from .hashindex import HashIndex
+from .iosched import IOScheduler
+from .journal import DoneJournal
+from .plan import PlanWriter, file_state, is_current, read_plan
+from .records import FileStore, SizeTable
+from .stats import Progress, Stats
+from .walker import walk_files, walk_folders
+
+
+# Command-line settings, replaced by cli.main.
+config = Config()
+
+# Counters and timings for each phase of the run, reported with --stats.
+stats = Stats()
+
+# Maps (source device, dest device) pairs to whether os.rename works between them;
+# it's turned off for a pair when rename fails with EXDEV.
+rename_devs = {}
+
+# Journal of files that move has already dealt with, opened by open_cache.
+done = None
+
+
+def open_cache():
+    global done
+    if done is not None:
+        return
+    done = DoneJournal(path_join(config.target, '/.photorger.journal'), readonly=config.nocache or config.pretend)
+    # Bring over the paths from the pickled set that older versions used
+    oldcache = path_join(config.target, '/.photorger.cache')
+    if os.path.exists(oldcache):
+        done.import_pickle(oldcache)
+        if not done.readonly:
+            os.replace(oldcache, oldcache + '.imported')
 
 
 def save_cache():
-    if not nocache and not pretend:
-        with open(cachefile + '.tmp', 'wb') as f:
-          pickle.dump(done, f)
-        os.replace(cachefile + '.tmp', cachefile)
+    global done
+    if done is not None:
+        done.close()
+        done = None
 
 
-def get_exif_tags(fname):
+def get_exif_tags(fname, names=None):
+    """ Get the EXIF tags from fname (maybe just the named ones), or None if it can't be read. """
+    # Imported here to keep startup quick for commands that don't need it
+    import exifread
     try:
         with open(fname, 'rb') as f:
-            return exifread.process_file(f, details=False)
+            header = f.read(EXIF_HEADER_SIZE)
+            stats.record('metadata', bytes_read=len(header))
+            if not may_have_exif(header):
+                return {}
+            if not names:
+                f.seek(0)
+                return exifread.process_file(f, details=False)
+            # With a single tag we can stop as soon as it's found
+            options = {'stop_tag': names[0].split(' ')[-1]} if len(names) == 1 else {}
+            try:
+                tags = exifread.process_file(io.BytesIO(header), details=False, **options)
+            except Exception:
+                tags = {}
+            if any(name not in tags for name in names) and len(header) == EXIF_HEADER_SIZE:
+                f.seek(0)
+                tags = exifread.process_file(f, details=False, **options)
+            return tags
     except Exception as e:
         return None
 
 
-def get_exif_date(fname):
+# Magic numbers of file formats that can carry EXIF data. Files that don't start
+# with one of these (videos, PDFs, etc) are not parsed at all.
+exif_magic = [
+    b'\xff\xd8\xff',  # JPEG
+    b'II*\x00',       # TIFF and most raw formats (little-endian)
+    b'MM\x00*',       # TIFF and most raw formats (big-endian)
+    b'IIRO', b'IIRS',  # Olympus ORF
+    b'IIU\x00',       # Panasonic RW2
+    b'FUJIFILM',      # Fuji RAF
+    b'\x89PNG',       # PNG
+]
+heif_brands = [b'heic', b'heix', b'heim', b'heis', b'hevc', b'mif1', b'msf1', b'avif']
+
+# How much of the start of a file to read when looking for the EXIF date. This
+# covers the whole APP1 segment of a JPEG and the EXIF IFD of most raw files.
+EXIF_HEADER_SIZE = 256 * 1024
+
+
+def may_have_exif(header):
+    for magic in exif_magic:
+        if header.startswith(magic):
+            return True
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return True
+    return header[4:8] == b'ftyp' and header[8:12] in heif_brands
+
+
+def get_exif_date_tags(fname):
+    """ Get just enough EXIF tags from fname to determine its creation date. """
+    import exifread
+    with open(fname, 'rb') as f:
+        header = f.read(EXIF_HEADER_SIZE)
+        stats.record('metadata', bytes_read=len(header))
+        if not may_have_exif(header):
+            return None
+        # SubSecTimeOriginal comes after DateTimeOriginal in the EXIF IFD so we can
+        # stop there.
+        try:
+            tags = exifread.process_file(io.BytesIO(header), stop_tag='SubSecTimeOriginal', details=False)
+        except Exception:
+            tags = None
+        if (not tags or 'EXIF DateTimeOriginal' not in tags) and len(header) == EXIF_HEADER_SIZE:
+            # The EXIF data may be beyond the header (some raw and HEIF files)
+            tags = exifread.process_file(f, stop_tag='SubSecTimeOriginal', details=False)
+        return tags
+
+
+def parse_exif_date(fname):
+    start = time.perf_counter()
     try:
-        tags = get_exif_tags(fname)
+        tags = get_exif_date_tags(fname)
         if tags is None:
             return None
         parts = str(tags['EXIF DateTimeOriginal']).split(' ')
@@ -74,98 +145,575 @@ def get_exif_date(fname):
             pass
         created = datetime.fromisoformat(f"{parts[0].replace(':', '-')} {parts[1]}.{msec:03d}")
         return created
+    except OSError:
+        raise
     except Exception as e:
-        if verbose:
+        if config.verbose:
             print(f"Can't get EXIF date from {fname}: {e}")
         return None
+    finally:
+        stats.record('metadata', seconds=time.perf_counter() - start, files=1)
+
+
+def lookup_exif_date(fname, size=None, mtime_ns=None):
+    """ Return fname's (size, mtime) and its cached EXIF date ('' if it has none, None if
+    it isn't cached). fname is only stat'ed if size isn't given. """
+    if hash_index is None:
+        return None, None
+    if size is None:
+        try:
+            st = os.stat(fname)
+        except OSError:
+            return None, None
+        size, mtime_ns = st.st_size, st.st_mtime_ns
+    cached = hash_index.lookup_date(fname, size, mtime_ns)
+    stats.cache_lookup('metadata', cached is not None)
+    return (size, mtime_ns), cached
+
+
+def read_exif_date(item):
+    """ Add the EXIF date and whether to store it to an item from lookup_exif_date.
+    This doesn't touch the index so it can run in worker threads. """
+    fname, state, cached = item
+    if cached is not None:
+        return fname, state, datetime.fromisoformat(cached) if cached else None, False
+    try:
+        return fname, state, parse_exif_date(fname), state is not None
+    except OSError as e:
+        if config.verbose:
+            print(f"Can't get EXIF date from {fname}: {e}")
+        return fname, state, None, False
+
+
+def store_exif_date(fname, state, created):
+    hash_index.store_date(fname, *state, created.isoformat() if created else '')
+
+
+def get_exif_date(fname):
+    _, state, created, store = read_exif_date((fname,) + lookup_exif_date(fname))
+    if store:
+        store_exif_date(fname, state, created)
+    return created
 
 
 BUF_SIZE = 65536
 
+# Size of the head and tail blocks used for the quick hash that weeds out files
+# which are the same size but obviously different.
+PARTIAL_BLOCK = 4096
+
+# Applies the --io-per-device, --io-rate and --drop-cache limits to hashing, comparing
+# and copying; created by get_iosched.
+iosched = None
+
+
+def get_iosched():
+    global iosched
+    if iosched is None:
+        iosched = IOScheduler(config.io_per_device, config.io_rate * 1e6, config.drop_cache)
+    return iosched
+
+
+def parallel_imap(fn, items, background=False):
+    """ Like map(fn, items), but runs up to --jobs calls at a time in threads, in order.
+    With background a thread is used even with --jobs=1, so producing items overlaps. """
+    if config.jobs <= 1 and not background:
+        yield from map(fn, items)
+        return
+    # Importing this also loads logging, which is slow enough to put off until needed
+    from concurrent.futures import ThreadPoolExecutor
+    workers = max(config.jobs, 1)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(fn, item))
+            if len(pending) >= 4 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
 def files_match(src, dst):
-    with open(src, "rb") as f1:
-        with open(dst, "rb") as f2:
-            block1 = block2 = True
-            while block1 or block2:
-              block1 = f1.read(BUF_SIZE)
-              block2 = f2.read(BUF_SIZE)
-              if block1 != block2:
-                return False
-            return True
-    return True
+    start = time.perf_counter()
+    n = 0
+    io = get_iosched()
+    try:
+        with open(src, "rb") as f1:
+            with open(dst, "rb") as f2, io.using(f1, f2):
+                block1 = block2 = True
+                while block1 or block2:
+                  block1 = io.read(f1, BUF_SIZE)
+                  block2 = io.read(f2, BUF_SIZE)
+                  n += len(block1) + len(block2)
+                  if block1 != block2:
+                    return False
+                return True
+        return True
+    finally:
+        stats.record('compare', seconds=time.perf_counter() - start, files=2, bytes_read=n)
 
 
-def hash_file(fname):
+def first_match(fname, candidates):
+    """ Return the first of candidates with the same content as fname, or None. """
+    for fname2 in candidates:
+        if config.nodeep or files_match(fname, fname2):
+            return fname2
+    return None
+
+
+# Most files split_identical will have open at once, shared between the --jobs
+# threads that may be running it; bigger groups are compared in chunks.
+MAX_OPEN_FILES = 128
+
+
+def lockstep_partition(files):
+    """ Partition files into classes of identical files, reading them all in step so
+    that each file is read at most once. """
+    start = time.perf_counter()
+    n = 0
+    io = get_iosched()
+    try:
+        with ExitStack() as stack:
+            handles = [stack.enter_context(open(fname, 'rb')) for fname in files]
+            stack.enter_context(io.using(*handles))
+            classes = [list(range(len(files)))]
+            done = []
+            while classes:
+                still_matching = []
+                for cls in classes:
+                    blocks = {}
+                    for i in cls:
+                        block = io.read(handles[i], BUF_SIZE)
+                        n += len(block)
+                        if block not in blocks:
+                            blocks[block] = [i]
+                        else:
+                            blocks[block].append(i)
+                    for block, members in blocks.items():
+                        if len(members) == 1:
+                            handles[members[0]].close()  # No need to keep reading it
+                            done.append(members)
+                        elif not block:
+                            done.append(members)  # Reached the end together
+                        else:
+                            still_matching.append(members)
+                classes = still_matching
+        done.sort()
+        return [[files[i] for i in cls] for cls in done]
+    finally:
+        stats.record('compare', seconds=time.perf_counter() - start, files=len(files), bytes_read=n)
+
+
+def split_identical(files):
+    """ Split files into groups of two or more identical files, in order of first appearance. """
+    files = list(files)
+    if config.nodeep:
+        return [files]
+    chunk = max(MAX_OPEN_FILES // max(config.jobs, 1), 2)
+    if len(files) <= chunk:
+        classes = lockstep_partition(files)
+    else:
+        classes = []
+        for i in range(0, len(files), chunk):
+            classes.extend(lockstep_partition(files[i:i + chunk]))
+        # Merge classes from different chunks whose first files match
+        merged = []
+        while classes:
+            cls = classes.pop(0)
+            i = 0
+            while i < len(classes):
+                if files_match(cls[0], classes[i][0]):
+                    cls = cls + classes.pop(i)
+                else:
+                    i += 1
+            merged.append(cls)
+        classes = merged
+    return [cls for cls in classes if len(cls) > 1]
+
+
+def compute_hash(fname):
+    start = time.perf_counter()
     sha1 = hashlib.sha1()
-    with open(fname, 'rb') as f:
+    n = 0
+    io = get_iosched()
+    with open(fname, 'rb') as f, io.using(f):
         while True:
-            data = f.read(BUF_SIZE)
+            data = io.read(f, BUF_SIZE)
             if not data:
                 break
+            n += len(data)
+            sha1.update(data)
+    stats.record('hash', seconds=time.perf_counter() - start, files=1, bytes_read=n)
+    return sha1.digest()
+
+
+def compute_partial_hash(fname):
+    start = time.perf_counter()
+    sha1 = hashlib.sha1()
+    io = get_iosched()
+    with open(fname, 'rb') as f, io.using(f):
+        data = io.read(f, PARTIAL_BLOCK)
+        n = len(data)
+        sha1.update(data)
+        size = os.fstat(f.fileno()).st_size
+        if size > PARTIAL_BLOCK:
+            f.seek(max(PARTIAL_BLOCK, size - PARTIAL_BLOCK))
+            data = io.read(f, PARTIAL_BLOCK)
+            n += len(data)
             sha1.update(data)
-    return sha1.hexdigest()
+    stats.record('hash', seconds=time.perf_counter() - start, files=1, bytes_read=n)
+    return sha1.digest()
+
+
+# Persistent index of content hashes, opened by open_hash_index. When this is None
+# every hash_file call reads the whole file.
+hash_index = None
+
+
+def open_hash_index(root):
+    global hash_index
+    if config.nocache or hash_index is not None:
+        return
+    if config.pretend and config.rebuild_index:
+        return  # The saved hashes can't be thrown away without writing the index
+    hash_index = HashIndex(path_join(root, '/.photorger.index'), readonly=config.pretend)
+    if config.rebuild_index:
+        print(f'Rebuilding hash index {hash_index.path}')
+        hash_index.clear()
+
+
+def close_hash_index():
+    global hash_index
+    if hash_index is not None:
+        if config.verbose and hash_index.hits + hash_index.misses:
+            print(f'Hash index: {hash_index.hits} hits, {hash_index.misses} misses')
+        hash_index.close()
+        hash_index = None
+
+
+def prune_hash_index(root, seen, recursive=True):
+    if hash_index is not None:
+        n = hash_index.prune(root, seen, recursive)
+        if n and config.verbose:
+            print(f'Pruned {n} stale hash index entries under {root}')
+
+
+def walk_source(on_dir=None):
+    """ Walk the source folder with walk_files, following --norecurse and --exclude. """
+    return stats.timed_iter('walk', walk_files(config.source, recursive=not config.norecurse,
+                                               exclude=config.exclude, on_dir=on_dir))
+
+
+def index_lookup(fname, partial):
+    """ Return the stat result for fname and its (partial) hash from the index, if known. """
+    if hash_index is None:
+        return None, None
+    st = os.stat(fname)
+    entry = hash_index.lookup(fname, st)
+    digest = None if entry is None else entry[1 if partial else 0]
+    if digest is None:
+        hash_index.misses += 1
+    else:
+        hash_index.hits += 1
+    stats.cache_lookup('hash', digest is not None)
+    return st, digest
+
+
+def index_store(fname, st, partial, h, cached):
+    if hash_index is None or h == cached:
+        return
+    if cached is not None:
+        print(f'Hash index entry for {fname} is wrong; updating')
+    entry = hash_index.lookup(fname, st)
+    entry = [None, None] if entry is None else list(entry)
+    entry[1 if partial else 0] = h
+    hash_index.store(fname, st, entry[0], entry[1])
+
+
+def indexed_hash(fname, partial):
+    st, cached = index_lookup(fname, partial)
+    if cached is not None and not config.verify_index:
+        return cached
+    h = compute_partial_hash(fname) if partial else compute_hash(fname)
+    index_store(fname, st, partial, h, cached)
+    return h
+
+
+def hash_files(fnames, partial, background=False):
+    """ Return a dict mapping each of fnames to its (partial) hash, hashing in parallel.
+    fnames may be a generator, and hashing starts as soon as it yields a name. """
+    hashes = {}
+
+    def to_compute():
+        for fname in fnames:
+            st, cached = index_lookup(fname, partial)
+            if cached is not None and not config.verify_index:
+                hashes[fname] = cached
+                status.update()
+            else:
+                yield fname, st, cached
+
+    compute = compute_partial_hash if partial else compute_hash
+    total = len(fnames) if hasattr(fnames, '__len__') else None
+    status = Progress('Quick hashing' if partial else 'Hashing', total, enabled=config.progress)
+    for (fname, st, cached), h in parallel_imap(lambda item: (item, compute(item[0])), to_compute(),
+                                                background):
+        index_store(fname, st, partial, h, cached)
+        hashes[fname] = h
+        status.update()
+    return hashes
+
+
+def hash_file(fname):
+    return indexed_hash(fname, partial=False)
+
+
+def partial_hash_file(fname):
+    return indexed_hash(fname, partial=True)
+
+
+def group_by_hash(fnames, hashes):
+    groups = {}
+    for fname in fnames:
+        h = hashes[fname]
+        if h not in groups:
+            groups[h] = [fname]
+        else:
+            groups[h].append(fname)
+    return groups
+
+
+def full_hashes(sizes, partials):
+    """ Return a dict of full hashes for files that are not fully covered by their partial hash. """
+    big = []
+    hashes = {}
+    for sz, fnames in sizes:
+        for fname in fnames:
+            # Files no bigger than the head and tail blocks were already hashed in full
+            if sz <= 2 * PARTIAL_BLOCK:
+                hashes[fname] = partials[fname]
+            else:
+                big.append(fname)
+    hashes.update(hash_files(big, partial=False))
+    return hashes
+
+
+# Listings of the folders we move files into, for existence checks and distinct
+# names; everything below that changes the file system keeps it up to date.
+dircache = DirCache()
 
 
 def make_folder_for_file(fname):
-    if not pretend:
-        dpath = fname[:fname.rfind('/')]
-        if not os.path.exists(dpath):
-            Path(dpath).mkdir(parents=True, exist_ok=True)
+    dpath = fname[:fname.rfind('/')]
+    if not dircache.exists(dpath):
+        if config.pretend:
+            dircache.evict = False
+        else:
+            os.makedirs(dpath, exist_ok=True)
+        dircache.add_dir(dpath)
 
 
 def rename_file(src, dst):
-    if not pretend:
+    if not config.pretend:
         os.rename(src, dst)
+        dircache.remove(src)
+        dircache.add(dst)
+
+
+# Where a --pretend run records the actions it would have taken; see open_plan.
+plan = None
+
+# When pretending, the caches are updated as if each action was taken; this maps
+# the target of each move or copy to the file its content is still in.
+planned = {}
+
+
+def content_path(fname):
+    """ Return the path fname's content can be read from, which when pretending is not
+    fname itself if fname is the target of a move or copy that wasn't done. """
+    return planned.get(fname, fname)
+
 
+def open_plan(path, command):
+    global plan
+    plan = PlanWriter(path, command, config.source, config.target, config.copy)
 
-def remove_file(fname):
-    if not pretend:
+
+def close_plan():
+    global plan
+    if plan is not None:
+        plan.close()
+        print(f'Wrote {plan.count} actions to {plan.f.name}')
+        plan = None
+
+
+def record_plan(action, fname, dst=None, duplicate=None, digest=None):
+    if plan is None:
+        return
+    if action == 'delete' and digest is None:
+        digest = hash_file(fname)
+    plan.add(action, fname, dst=dst, duplicate=duplicate, digest=digest,
+             duplicate_from=planned.get(duplicate))
+
+
+def remove_file(fname, duplicate=None, digest=None):
+    """ Delete fname, which is identical to the file duplicate (and has the given digest, if
+    known); these are only used to justify the delete in a --plan-out plan. """
+    if config.pretend:
+        record_plan('delete', fname, duplicate=duplicate, digest=digest)
+        dircache.evict = False
+    else:
         os.remove(fname)
+    dircache.remove(fname)
+
+
+# Device of each dest folder we have moved files into
+folder_devs = {}
+
+# Does the copying when rename can't be used; created by get_copier.
+copier = None
+
+# Destinations of background copies not collected yet (so call wait_for_copy before
+# reading them), mapped to whether they should then go in the done journal.
+copying = {}
+
 
+def get_copier():
+    global copier
+    if copier is None:
+        copier = Copier(config.copy_jobs, get_iosched())
+    return copier
 
-def copy_file(src, dst):
-    if not pretend:
-        copyfile(src, dst)
+
+def copy_job(src, dst, devs, remove_src):
+    """ Copy src to dst, and then remove src if remove_src is set. This doesn't touch
+    any shared state other than stats, so it can run in a copier thread. """
+    start = time.perf_counter()
+    size = os.path.getsize(src)
+    try:
+        get_copier().copy(src, dst, devs)
+        if config.verify_copies and not files_match(src, dst):
+            raise OSError(f'{dst} does not match {src} after copying')
+    except Exception:
+        # Don't leave a partial copy behind
+        try:
+            os.remove(dst)
+        except OSError:
+            pass
+        raise
+    if remove_src:
+        os.remove(src)
+    stats.record('relocate', seconds=time.perf_counter() - start, files=1, bytes_read=size, bytes_written=size)
+
+
+def copy_file(src, dst, devs=None, remove_src=False):
+    if not config.pretend:
+        if config.copy_jobs > 1:
+            # Update the caches now as if the copy has succeeded; copy_failed undoes this if not
+            dircache.add(dst)
+            if remove_src:
+                dircache.remove(src)
+            copying[dst] = False
+            collect_copies(get_copier().submit(copy_job, src, dst, devs, remove_src))
+        else:
+            copy_job(src, dst, devs, remove_src)
+            dircache.add(dst)
+            if remove_src:
+                dircache.remove(src)
+
+
+def copy_failed(src, dst, remove_src, e):
+    print(f'Copy {src} to {dst} failed: {e}')
+    dircache.remove(dst)
+    if remove_src:
+        dircache.add(src)
+    if done is not None:
+        done.discard(src)
+        done.discard(dst)
+
+
+def collect_copies(results):
+    """ Deal with the results of background copies, from the copier. """
+    for (src, dst, devs, remove_src), e in results:
+        journal = copying.pop(dst, False)
+        if e is not None:
+            copy_failed(src, dst, remove_src, e)
+        elif journal and done is not None:
+            done.add(dst)
+
+
+def wait_for_copy(fname):
+    """ Wait for the background copy to fname to finish, if there is one, so that fname
+    can be read. """
+    while fname in copying and copier is not None:
+        collect_copies(copier.finished(wait=True))
+
+
+def mark_done(fname):
+    """ Add fname to the done journal, once the copy to it has finished if it's still
+    being copied (the journal records its size and mtime). """
+    if fname in copying:
+        copying[fname] = True
+    else:
+        done.add(fname)
+
+
+def finish_copies():
+    """ Wait for any background copies to finish. """
+    global copier
+    if copier is not None:
+        collect_copies(copier.close())
+        copier = None
 
 
 def relocate_file(src, dst):
-    global use_rename
-    if use_rename and not copy:
+    start = time.perf_counter()
+    dpath = dst[:dst.rfind('/')]
+    if config.pretend:
+        if config.copy:
+            record_plan('copy', src, dst)
+            planned[dst] = content_path(src)
+        else:
+            record_plan('rename' if dpath == src[:src.rfind('/')] else 'move', src, dst)
+            planned[dst] = planned.pop(src, src)
+            dircache.remove(src)
+        dircache.add(dst)
+        dircache.evict = False
+        stats.record('relocate', files=1)
+        return
+    if dpath not in folder_devs:
+        folder_devs[dpath] = os.stat(dpath).st_dev
+    devs = (os.stat(src).st_dev, folder_devs[dpath])
+    if rename_devs.get(devs, True) and not config.copy:
         # we are moving the file with a rename
         try:
             rename_file(src, dst)
+            stats.record('relocate', seconds=time.perf_counter() - start, files=1)
             return
-        except Exception as e:
-            use_rename = False
-    
-    copy_file(src, dst)
-    if not copy:
-        remove_file(src)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            rename_devs[devs] = False
+
+    copy_file(src, dst, devs, remove_src=not config.copy)
 
 
 def generate_distinct_name(fname):
-    # TODO: make this safe for files that have no '.'
-    split = fname.rfind('.')
-    dst0 = fname[:split]
-    dst1 = fname[split:]
-    i = 1
-    while True:
-        dst = f'{dst0}({i}){dst1}'
-        if not os.path.exists(dst):
-            return dst
-        i += 1
+    return dircache.distinct_name(fname)
 
 
 def move_file(src, dst):
-    if os.path.exists(dst):
-        if os.path.getsize(src) == os.path.getsize(dst) and (nodeep or files_match(src, dst)):
-            if noclean:
+    if dircache.exists(dst):
+        wait_for_copy(dst)
+        existing = content_path(dst)
+        if os.path.getsize(src) == os.path.getsize(existing) and (config.nodeep or files_match(src, existing)):
+            if config.noclean:
                 print(f'Rename {src} to {dst} failed: target exists and is duplicate')
             else:
                 print(f'Rename {src} to {dst} failed: duplicate target exists; removing source')
-                remove_file(src)
+                remove_file(src, duplicate=dst)
             return True
-        elif norename:
+        elif config.norename:
             print(f'Rename {src} to {dst} failed: target exists and is not duplicate and --norename was used')
             return False
         else: # Target exists and is not a dup; create a new name for target
@@ -173,97 +721,100 @@ def move_file(src, dst):
 
     # Make sure target folder exists
     make_folder_for_file(dst)
+    # Something else may have created dst since its folder was listed; checking here
+    # costs one stat and makes sure we never overwrite it
+    if not config.pretend and dircache.appeared(dst):
+        return move_file(src, dst)
     try:
+        # A background copy may not have created dst yet, and src may be gone
+        size = os.path.getsize(src)
         relocate_file(src, dst)
         print(f'Rename {src} to {dst}')
+        add_to_library(dst, size)
         return True
     except Exception as e:
         print(f'Rename {src} to {dst} failed: {e}')
         return False
 
 
-def get_date_from_path(fname):
-    # Try to extract a date from the file name or path
-    year = 0
-    month = 0
-    day = 0
-    name = fname
-    m = path_re1.match(fname)
-    if m:
-        year = int(m.group(2))
-        month = int(m.group(3))
-        day = int(m.group(4))
-        name = m.group(5)
-    else:
-        m = path_re2.match(fname)
-        if m:
-            year = int(m.group(2))
-            month = int(m.group(3))
-            name = m.group(4)
-        else:
-            m = path_re3.match(fname)
-            if m:
-                year = int(m.group(2))
-                name = m.group(3)
-
-    # TODO: use file name as a potential date source too
-    return year, month, day, name
-
-
-# Handle names of form "YYYY-MM-DD..." or "...YYYYMMDD..."
-iso_date_re = re.compile('(^|[^0-9])([12][90][01289][0-9])-?([01][0-9])-?([0123][0-9])([^0-9]|$)')
-# Handle names of form "...Jan 16, 2017..." or "...January 16, 2007..."
-txt_date_re1 = re.compile('(^|[^0-9A-Za-z])([A-Za-z]+)[^0-9A-Za-z]+([0-9]{1,2})[^A-Za-z0-9]+([12][90][01289][0-9])($|[^0-9])')
-# Handle names of form "...16 Jan, 2017..." or "...16 January, 2007..."
-txt_date_re2 = re.compile('(^|[^0-9A-Za-z])([0-9]{1,2})[^0-9A-Za-z]+([A-Za-z]+)[^A-Za-z0-9]+([12][90][01289][0-9])($|[^0-9])')
-months = {k: (v+1) for v, k in enumerate(['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'])}
-
-
-def get_date_from_name(fname):
-    m = iso_date_re.match(fname)
-    if m:
-        try:
-            return datetime(int(m.group(2)), int(m.group(3)), int(m.group(4)))
-        except Exception:
-            pass
-
-    m = txt_date_re1.match(fname)
-    if m:
-        month = m.group(2)[:3].lower()
-        if month in months.keys():
-            try:
-                return datetime(int(m.group(4)), months[month], int(m.group(3)))
-            except Exception:
-                pass
-
-    m = txt_date_re2.match(fname)
-    if m:
-        month = m.group(3)[:3].lower()
-        if month in months.keys():
-            try:
-                return datetime(int(m.group(4)), months[month], int(m.group(2)))
-            except Exception:
-                pass
-
-    return None
+# The files in the dest folder, loaded when move first needs them, by size; library_hashes
+# maps an id to [partial hash, full hash], each None until it's needed.
+library = None
+library_sizes = None
+library_hashes = {}
+
+
+def load_library():
+    global library, library_sizes
+    if library is None:
+        library = FileStore()
+        library_sizes = SizeTable()
+        # This includes the source folder if it's in the dest folder (or is it);
+        # find_in_library makes sure a file is never a duplicate of itself
+        for f in stats.timed_iter('walk', walk_files(config.target, exclude=config.exclude)):
+            add_to_library(f.path, f.size)
+    return library
+
+
+def add_to_library(fname, size=None):
+    if library is None:
+        return
+    if size is None:
+        size = os.path.getsize(fname)
+    library_sizes.add(size, library.add(fname))
+
+
+def find_in_library(fname):
+    """ Return the path of a file in the dest folder with the same content as fname, or None.
+    fname itself (under any path) is never a match. """
+    load_library()
+    st = os.stat(fname)
+    ids = library_sizes.get(st.st_size)
+    if not ids:
+        return None
+    # Files moved or removed since they were added are still in the library, but
+    # not in the dircache
+    entries = {library.path(n): library_hashes.setdefault(n, [None, None]) for n in ids}
+    entries = {path: hashes for path, hashes in entries.items() if path != fname and dircache.exists(path)}
+    for path in entries:
+        wait_for_copy(path)
+    try:
+        unhashed = {content_path(path): path for path, hashes in entries.items() if hashes[0] is None}
+        for path, h in hash_files(list(unhashed), partial=True).items():
+            entries[unhashed[path]][0] = h
+        p = partial_hash_file(fname)
+        candidates = [path for path, hashes in entries.items() if hashes[0] == p]
+        if not candidates:
+            return None
+        if st.st_size > 2 * PARTIAL_BLOCK:
+            unhashed = {content_path(path): path for path in candidates if entries[path][1] is None}
+            for path, h in hash_files(list(unhashed), partial=False).items():
+                entries[unhashed[path]][1] = h
+            h = hash_file(fname)
+            candidates = [path for path in candidates if entries[path][1] == h]
+        candidates = {content_path(path): path for path in candidates}
+        match = first_match(fname, [path for path in candidates if not os.path.samestat(st, os.stat(path))])
+        return candidates.get(match)
+    except OSError as e:
+        print(f"Can't check {fname} for duplicates in {config.target}: {e}")
+        return None
 
 
-def move_process(fname):
-    # Check location against EXIF data. If there is EXIF data and file is in a date-structured folder
-    # but the wrong location, move it.
-    created = get_exif_date(fname)
+def move_process(fname, created):
+    # Check location against EXIF data (created, which is None if there is none). If there is
+    # EXIF data and file is in a date-structured folder but the wrong location, move it.
     reason = '(name)'
     from_exif = False
     from_name = False
     if created is None:
-        created = get_date_from_name(fname)
+        created = date_from_name(fname)
     else:
         reason = '(EXIF)'
         from_exif = True
     if created:
         name = fname[fname.rfind('/')+1:]
-        dst = f"{target}/{created.year}/{created.month:02d}/{created.day:02d}/{name}"
-        year, month, day, name = get_date_from_path(fname)
+        dst = f"{config.target}/{created.year}/{created.month:02d}/{created.day:02d}/{name}"
+        year, month, day, name = date_from_path(fname)
         if year:
             if year != created.year:
                 print(f"{fname} was created at {created} {reason} but is in year folder {year}; move to {dst}")
@@ -272,28 +823,78 @@ def move_process(fname):
             elif day != created.day:
                 print(f"{fname} was created at {created} {reason} but is in day folder {day}; move to {dst}")
             else:
-                if verbose:
+                if config.verbose:
                     print(f"{fname} was created at {created} {reason} and is properly located")
                 done.add(fname)
                 return
         else:
             print(f"{fname} was created at {created} {reason} and needs to be moved")
 
+        if not config.nodupcheck:
+            dup = find_in_library(fname)
+            if dup:
+                if config.noclean:
+                    print(f'Rename {fname} to {dst} skipped: {dup} is a duplicate')
+                else:
+                    print(f'Rename {fname} to {dst} skipped: {dup} is a duplicate; removing source')
+                    remove_file(fname, duplicate=dup)
+                done.add(fname)
+                return
+
         if move_file(fname, dst):
             done.add(fname)
-            done.add(dst)
+            mark_done(dst)
     else:
-        if verbose:
+        if config.verbose:
             print(f"Cannot infer creation date for {fname}; skipping")
 
 
 
-def info_main(fname):
-    # TODO: add more info here
-    tags = get_exif_tags(fname)
-    if tags:
-        for k, v in tags.items():
-            print(f'{k:24s}: {v}')
+def info_files(fnames):
+    for fname in fnames:
+        if os.path.isdir(fname):
+            files = walk_files(fname, recursive=not config.norecurse, exclude=config.exclude)
+            for f in stats.timed_iter('walk', files):
+                yield f.path
+        else:
+            yield fname
+
+
+def read_info(fname, names):
+    start = time.perf_counter()
+    tags = get_exif_tags(fname, names) or {}
+    stats.record('metadata', seconds=time.perf_counter() - start, files=1)
+    return fname, {k: v for k, v in tags.items() if not names or k in names}
+
+
+def info_main(fnames, names=None, fmt='text'):
+    """ Print the EXIF tags (or just the named ones) of fnames and the files in any folders among them. """
+    if fmt == 'csv':
+        import csv
+        writer = csv.writer(sys.stdout, lineterminator='\n')
+        writer.writerow(['path'] + names if names else ['path', 'tag', 'value'])
+    # The output for a single file is just its tags, as it always has been
+    single = len(fnames) == 1 and not os.path.isdir(fnames[0])
+    status = Progress('Read', enabled=config.progress)
+    for fname, tags in parallel_imap(lambda fname: read_info(fname, names), info_files(fnames)):
+        status.update()
+        if fmt == 'text':
+            if not single:
+                print(fname)
+            for k, v in tags.items():
+                print(f'{k:24s}: {v}')
+            continue
+        # Leave out binary values (such as thumbnails)
+        values = {k: str(v) for k, v in tags.items() if not isinstance(v, bytes)}
+        if names:
+            values = {name: values.get(name) for name in names}
+        if fmt == 'jsonl':
+            print(json.dumps(dict(path=fname, **values)))
+        elif names:
+            writer.writerow([fname] + ['' if v is None else v for v in values.values()])
+        else:
+            for k, v in values.items():
+                writer.writerow([fname, k, v])
 
 
 def path_join(a, b):
@@ -314,34 +915,25 @@ def path_join(a, b):
 def process_dup_group(group, key=None, descending=False):
     """ Sort group by key then pop off all leading elements with same key. """
     s = sorted(group, key=key, reverse=descending)
-    first = group.pop(0)
+    first = s.pop(0)
     if key is not None:
         keep_key = key(first)
-        while len(group):
-            if key(group[0]) != keep_key:
+        while len(s):
+            if key(s[0]) != keep_key:
                 break
-            group.pop(0)
-    return group
+            s.pop(0)
+    return s
 
 
 def get_files_with_no_date_in_path(group):
-    rtn = []
-    for fname in group:
-        year, month, day, _ = get_date_from_path(fname)
-        if year == 0:
-            rtn.append(fname)
+    dates = infer_dates(group)
+    rtn = [fname for fname in group if dates[fname].year == 0]
 
     if len(rtn) == 0:  # All had years; see if any don't have months
-        for fname in group:
-            year, month, day, _ = get_date_from_path(fname)
-            if month == 0:
-                rtn.append(fname)
+        rtn = [fname for fname in group if dates[fname].month == 0]
 
     if len(rtn) == 0:  # All had years and months; see if any don't have days
-        for fname in group:
-            year, month, day, _ = get_date_from_path(fname)
-            if day == 0:
-                rtn.append(fname)
+        rtn = [fname for fname in group if dates[fname].day == 0]
 
     if len(rtn) == len(group):
         return []  # None had paths so we don't know what to keep; just keep all
@@ -349,150 +941,418 @@ def get_files_with_no_date_in_path(group):
 
 
 def clean_main():
-    to_check = {}
-    have = {}
+    files = FileStore()
+    to_check = SizeTable()
+    have = SizeTable()
+    open_hash_index(config.target if config.target else config.source)
+
+    # Find all the files to check, hashing each size's files as soon as there are two
+    def source_files_to_hash():
+        for f in walk_source(on_dir=lambda d: print(f'Adding files from source folder {d}')):
+            count = to_check.add(f.size, files.add(f.path))
+            if not config.target and count > 1:
+                if count == 2:
+                    yield files.path(to_check.get(f.size)[0])
+                yield f.path
+
+    partials = hash_files(source_files_to_hash(), partial=True, background=True)
+    prune_hash_index(config.source, files, recursive=not config.norecurse)
+
+    if config.target:
+        # Find all the files that may have existing dups, making sure to 
+        # exclude the source files so we don't treat any files as dups of themselves.
+        spath = config.source.rstrip('/') + '/'
 
-    # Find all the files to check
-    for filename in glob.iglob(path_join(source, '/**/*'), recursive=not norecurse):
-        if filename.find('@eaDir') >= 0 or filename.find('#recycle') >= 0:  # Synology use only; need a way to configure these
-            continue
-        if not os.path.isfile(filename):
-            if os.path.isdir(filename):
-                print(f'Adding files from source folder {filename}')
-            continue
-        sz = os.path.getsize(filename)
-        path = filename
-        #path = os.path.abspath(filename)  # probably redundant
-        if sz not in to_check:
-            to_check[sz] = [path]
-        else:
-            to_check[sz].append(path)
+        def target_files_to_hash():
+            for f in stats.timed_iter('walk', walk_files(config.target, exclude=config.exclude, prune=[config.source],
+                                      on_dir=lambda d: print(f'Adding files from target folder {d}'))):
+                if f.path.startswith(spath):  # Skip files in source folder
+                    continue
+                n = files.add(f.path)
+                if f.size not in to_check:
+                    continue
+                if have.add(f.size, n) == 1:
+                    yield from files.paths(to_check.get(f.size))
+                yield f.path
 
-    if target:
-        # Find all the files that may have existing dups, making sure to 
-        # exclude the files found above so we don't treat any files as dups
-        # of themselves.
-        spath = source
-        if spath[-1] != '/':
-            spath += '/'
-        for filename in glob.iglob(path_join(target, '/**/*'), recursive=True):
-            if filename.find('@eaDir') >= 0 or filename.find('#recycle') >= 0:  # Synology use only; need a way to configure these
-                continue
-            if filename[:len(spath)] == spath: # Skip files in source folder
-                continue
-            if not os.path.isfile(filename):
-                if os.path.isdir(filename):
-                    print(f'Adding files from target folder {filename}')
-                continue
-            sz = os.path.getsize(filename)
-            path = filename
-            #path = os.path.abspath(filename)  # probably redundant
-            if sz not in to_check:
-                continue
-            if sz not in have:
-                have[sz] = {path: None}
-            else:
-                have[sz][path] = None
+        partials = hash_files(target_files_to_hash(), partial=True, background=True)
+        # files also holds the source files, which are not stale in the target's index
+        prune_hash_index(config.target, files)
 
         # Now check each file. If there are no others with same size, we are done. 
         # Otherwise we need to compute hashes of contents and look for a match.
-        for sz in to_check:
-            if sz not in have:
-                continue
-            # Compute hashes of targets
-            to_hash = have[sz]
-            for fname in to_hash.keys():
-                to_hash[fname] = hash_file(fname)
-
-            for fname in to_check[sz]:
-                h = hash_file(fname)
-                for fname2 in to_hash.keys():
-                    if h == to_hash[fname2]:
-                        # Hashes match, do deep compare if not disabled
-                        if nodeep or files_match(fname, fname2):
-                            print(f"Deleting {fname} which is a duplicate of {fname2}")
-                            remove_file(fname)
-                            break
+        sizes = [sz for sz in to_check if sz in have]
+        candidates = []
+        for sz in sizes:
+            targets = group_by_hash(files.paths(have.get(sz)), partials)
+            sources = group_by_hash(files.paths(to_check.get(sz)), partials)
+            for p in sources:
+                if p in targets:
+                    candidates.append((sz, sources[p], targets[p]))
+        hashes = full_hashes([(sz, sources + targets) for sz, sources, targets in candidates], partials)
+
+        to_compare = []
+        for sz, sources, targets in candidates:
+            targets = group_by_hash(targets, hashes)
+            for fname in sources:
+                h = hashes[fname]
+                if h in targets:
+                    # Hashes match, do deep compare if not disabled
+                    to_compare.append((fname, targets[h]))
+        matches = parallel_imap(lambda c: first_match(*c), to_compare)
+        status = Progress('Comparing', len(to_compare), enabled=config.progress)
+
+        for (fname, _), fname2 in zip(to_compare, matches):
+            status.update()
+            if fname2 is not None:
+                print(f"Deleting {fname} which is a duplicate of {fname2}")
+                remove_file(fname, duplicate=fname2, digest=hashes[fname])
     else:
         # Target was not set, we are looking within a directory
-        for sz in to_check:
-            if len(to_check[sz]) < 2:
-                continue
-            hashes = {}
-            for fname in to_check[sz]:
-                h = hash_file(fname)
-                if h not in hashes:
-                    hashes[h] = [fname]
+        sizes = [sz for sz in to_check if to_check.count(sz) > 1]
+        candidates = []
+        for sz in sizes:
+            for fnames in group_by_hash(files.paths(to_check.get(sz)), partials).values():
+                if len(fnames) > 1:
+                    candidates.append((sz, fnames))
+        hashes = full_hashes(candidates, partials)
+
+        to_split = []
+        for sz, fnames in candidates:
+            for files in group_by_hash(fnames, hashes).values():
+                # We have 2 or more files with the same hash.
+                if len(files) > 1:
+                    to_split.append(files)
+
+        status = Progress('Comparing', len(to_split), enabled=config.progress)
+        for groups in parallel_imap(split_identical, to_split):
+            status.update()
+            for group in groups:
+                print(f'Duplicate group {group}')
+                # Figure out which to delete
+                if config.newest:
+                    to_delete = process_dup_group(group, key=os.path.getmtime, descending=True)
+                elif config.oldest:
+                    to_delete = process_dup_group(group, key=os.path.getmtime, descending=False)
+                elif config.shortest:
+                    to_delete = process_dup_group(group, key=lambda n: len(n.split('/')), descending=False)
+                elif config.longest:
+                    to_delete = process_dup_group(group, key=lambda n: len(n.split('/')), descending=True)
                 else:
-                    hashes[h].append(fname)
+                    to_delete = get_files_with_no_date_in_path(group)
 
-            for h in hashes.keys():
-                if len(hashes[h]) < 2:
-                    continue
-                # We have 2 or more files with the same hash.
-                files = list(hashes[h])
-                # We pop first file from the list, do pairwise compares with the rest, and 
-                # remove any others that match and put them in a set; after dealing with that
-                # set we repeat the process with any remaining ones in the list, if any.
-                while len(files) > 1:
-                    fname = files.pop(0)
-                    i = 0
-                    group = [fname]
-                    while i < len(files):
-                        if nodeep or files_match(fname, files[i]):
-                            group.append(files.pop(i))
-                        else:
-                            i += 1
-                    print(f'Duplicate group {group}')
-                    # Figure out which to delete
-                    if newest:
-                        to_delete = process_dup_group(group, key=os.path.getmtime, descending=True)
-                    elif oldest:
-                        to_delete = process_dup_group(group, key=os.path.getmtime, descending=False)
-                    elif shortest:
-                        to_delete = process_dup_group(group, key=lambda n: len(n.split('/')), descending=False)
-                    elif longest:
-                        to_delete = process_dup_group(group, key=lambda n: len(n.split('/')), descending=True)
-                    else:
-                        to_delete = get_files_with_no_date_in_path(group)
-
-                    if len(to_delete):
-                        print(f'Deleting subgroup {to_delete}')
-                        for fname in to_delete:
-                            remove_file(fname)
-
-                    if len(group) - len(to_delete) > 1 and force:
-                        # Do a second pass, just using lexical ordering
-                        to_delete = process_dup_group([x for x in group if x not in to_delete])
-                        print(f'Force deleting subgroup {to_delete}')
-                        for fname in to_delete:
-                            remove_file(fname)
+                keep = [x for x in group if x not in to_delete]
+                if len(to_delete):
+                    print(f'Deleting subgroup {to_delete}')
+                    for fname in to_delete:
+                        remove_file(fname, duplicate=keep[0], digest=hashes[fname])
+
+                if len(keep) > 1 and config.force:
+                    # Do a second pass, just using lexical ordering
+                    to_delete = process_dup_group(keep)
+                    keep = [x for x in keep if x not in to_delete]
+                    print(f'Force deleting subgroup {to_delete}')
+                    for fname in to_delete:
+                        remove_file(fname, duplicate=keep[0], digest=hashes[fname])
 
+    print(f"Read {stats.phases['hash'].bytes_read} bytes for hashes and "
+          f"{stats.phases['compare'].bytes_read} bytes for deep compares")
 
 
 def move_main():
-    for filename in glob.iglob(path_join(source, '/**/*'), recursive=not norecurse):
-        if not os.path.isfile(filename):
-            continue
-        if filename.find('@eaDir') >= 0 or filename.find('#recycle') >= 0:  # Synology use only; need a way to configure these
-            continue
-        if filename in done:
-            continue
-        move_process(filename)
+    open_hash_index(config.target)
+    open_cache()
+    seen = FileStore()
+
+    def to_process():
+        for f in walk_source():
+            seen.add(f.path)
+            if done.contains(f.path, f.size, f.mtime_ns):
+                continue
+            yield (f.path,) + lookup_exif_date(f.path, f.size, f.mtime_ns)
+
+    # EXIF dates are read by up to --jobs threads, but the index, the done cache and
+    # the files themselves are only updated here, in the order the files were found.
+    status = Progress('Processed', enabled=config.progress)
+    for fname, state, created, store in parallel_imap(read_exif_date, to_process()):
+        status.update()
+        if store:
+            store_exif_date(fname, state, created)
+        move_process(fname, created)
+    prune_hash_index(config.source, seen, recursive=not config.norecurse)
+
+
+def watch_main():
+    """ Keep moving files from the source folder into place as they settle, until interrupted. """
+    global library, library_hashes
+    from .watcher import Watcher
+    open_hash_index(config.target)
+    open_cache()
+    watcher = Watcher(config.source, recursive=not config.norecurse, exclude=config.exclude)
+    if watcher.fd is None:
+        print(f"Can't use inotify; watching {config.source} by scanning it every {config.rescan} minutes")
+    else:
+        print(f'Watching {config.source}')
+    # Files waiting to settle, with the (size, mtime) they had and when they were first seen with it
+    pending = {}
+
+    def note(fname):
+        try:
+            st = os.stat(fname)
+        except OSError:
+            pending.pop(fname, None)  # Gone already
+            return
+        state = (st.st_size, st.st_mtime_ns)
+        if fname not in pending or pending[fname][0] != state:
+            pending[fname] = (state, time.monotonic())
+
+    status = Progress('Processed', enabled=config.progress)
+    last_scan = next_scan = time.monotonic()
+    try:
+        while True:
+            now = time.monotonic()
+            if watcher.rescan or now >= next_scan:
+                watcher.rescan = False
+                # Files that were never closed but haven't changed since the last scan
+                # aren't being written after all
+                watcher.writing = {fname for fname in watcher.writing
+                                   if fname in pending and pending[fname][1] > last_scan}
+                last_scan = now
+                seen = FileStore()
+                for f in walk_source():
+                    seen.add(f.path)
+                    if not done.contains(f.path, f.size, f.mtime_ns):
+                        note(f.path)
+                prune_hash_index(config.source, seen, recursive=not config.norecurse)
+                # Other programs may have changed the dest folder since we last looked
+                library = None
+                library_hashes = {}
+                dircache.clear()
+                now = time.monotonic()
+                next_scan = now + config.rescan * 60
+            timeout = next_scan - now
+            waiting = [since for fname, (_, since) in pending.items() if fname not in watcher.writing]
+            if waiting:
+                timeout = min(timeout, min(waiting) + config.settle - now)
+            for fname in watcher.changes(timeout):
+                note(fname)
+
+            now = time.monotonic()
+            ready = []
+            for fname, (state, since) in list(pending.items()):
+                if now - since < config.settle or fname in watcher.writing:
+                    continue
+                note(fname)
+                if pending.get(fname) == (state, since):
+                    del pending[fname]
+                    if not done.contains(fname, *state):
+                        ready.append((fname, state))
+            if not ready:
+                continue
+            items = [(fname,) + lookup_exif_date(fname, *state) for fname, state in ready]
+            for fname, state, created, store in parallel_imap(read_exif_date, items):
+                status.update()
+                if store:
+                    store_exif_date(fname, state, created)
+                move_process(fname, created)
+            # Make sure everything done so far survives the daemon being killed
+            finish_copies()
+            done.flush()
+            if hash_index is not None:
+                hash_index.commit()
+    finally:
+        watcher.close()
+
+
+def unshadow_key(name):
+    """ The name that name is seen as on a case-insensitive file system (that also ignores
+    Unicode normalization, with --normalize). """
+    if config.normalize:
+        name = unicodedata.normalize('NFC', name)
+    return name.lower()
 
 
 def unshadow_main():
-    files = set()
-    for filename in glob.iglob(path_join(source, '/**/*'), recursive=not norecurse):
-        if not os.path.isfile(filename):
+    """ Rename files that would shadow another in the same folder on a case-insensitive file system. """
+    status = Progress('Folders', enabled=config.progress)
+    folders = walk_folders(config.source, recursive=not config.norecurse, exclude=config.exclude, jobs=config.jobs)
+    for dpath, names, files in stats.timed_iter('walk', folders):
+        status.update()
+        groups = {}
+        for entry in files:
+            key = unshadow_key(entry.name)
+            if key not in groups:
+                groups[key] = [entry.name]
+            else:
+                groups[key].append(entry.name)
+        clashes = [group for group in groups.values() if len(group) > 1]
+        if not clashes:
             continue
-        if filename.find('@eaDir') >= 0 or filename.find('#recycle') >= 0:  # Synology use only; need a way to configure these
+        # The new names must not clash with anything in the folder (including hidden
+        # files and subfolders), or with each other
+        dircache.store(dpath, Listing(names))
+        used = {unshadow_key(name) for name in names}
+        for group in clashes:
+            # The first one listed keeps its name
+            for name in group[1:]:
+                src = f'{dpath}/{name}'
+                dst = dircache.distinct_name(src, nocase=True)
+                while unshadow_key(dst[len(dpath) + 1:]) in used:
+                    dst = dircache.distinct_name(src, nocase=True)
+                used.add(unshadow_key(dst[len(dpath) + 1:]))
+                move_file(src, dst)
+    finish_copies()
+
+
+def read_image_pixels(item):
+    """ Return an (id, path, state) item with the pixels to hash from its EXIF thumbnail or
+    image, or None if it can't be decoded. This can run in worker threads. """
+    import exifread
+    from .phash import image_pixels, thumbnail_pixels
+    _, fname, _ = item
+    start = time.perf_counter()
+    pixels = None
+    n = 0
+    try:
+        with open(fname, 'rb') as f:
+            header = f.read(EXIF_HEADER_SIZE)
+            n = len(header)
+            # Thumbnails are in the EXIF data of JPEGs and TIFF-based raw files
+            if header[:3] == b'\xff\xd8\xff' or header[:4] in [b'II*\x00', b'MM\x00*']:
+                try:
+                    thumbnail = exifread.process_file(io.BytesIO(header), details=False).get('JPEGThumbnail')
+                except Exception:
+                    thumbnail = None
+                if thumbnail:
+                    pixels = thumbnail_pixels(thumbnail)
+            if pixels is None:
+                f.seek(0)
+                pixels = image_pixels(f)
+                n = max(n, f.tell())
+    except OSError as e:
+        if config.verbose:
+            print(f"Can't read {fname}: {e}")
+    stats.record('metadata', seconds=time.perf_counter() - start, files=1, bytes_read=n)
+    return item, pixels
+
+
+# Number of decoded images to hash at a time
+PHASH_BATCH = 256
+
+
+def similar_main():
+    """ Print groups of images under source whose perceptual hashes are within --distance bits. """
+    from .bktree import BKTree
+    from .phash import Image, dhash_batch
+    if Image is None:
+        sys.exit('The similar command needs Pillow; install it with pip install Pillow')
+    open_hash_index(config.source)
+    files = FileStore()
+    ids = []
+    hashes = []
+
+    def to_decode():
+        for f in walk_source():
+            n = files.add(f.path)
+            cached = None
+            if hash_index is not None:
+                cached = hash_index.lookup_phash(f.path, f.size, f.mtime_ns)
+                stats.cache_lookup('metadata', cached is not None)
+            if cached is None:
+                yield n, f.path, (f.size, f.mtime_ns)
+            elif cached >= 0:
+                ids.append(n)
+                hashes.append(cached)
+
+    def hash_batch(batch):
+        for ((n, fname, state), _), h in zip(batch, dhash_batch([pixels for _, pixels in batch])):
+            ids.append(n)
+            hashes.append(h)
+            if hash_index is not None:
+                hash_index.store_phash(fname, *state, h)
+
+    batch = []
+    for (n, fname, state), pixels in parallel_imap(read_image_pixels, to_decode()):
+        if pixels is None:
+            if hash_index is not None:
+                hash_index.store_phash(fname, *state, -1)
             continue
-        lowfilename = filename.lower()
-        if lowfilename in files:
-            dst = generate_distinct_name(filename)
-            move_file(filename, dst)
-            files.add(dst)
+        batch.append(((n, fname, state), pixels))
+        if len(batch) >= PHASH_BATCH:
+            hash_batch(batch)
+            batch = []
+    hash_batch(batch)
+    prune_hash_index(config.source, files, recursive=not config.norecurse)
+
+    # Join each image into a group with any earlier ones that are close enough
+    tree = BKTree()
+    parent = list(range(len(hashes)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    status = Progress('Comparing', len(hashes), enabled=config.progress)
+    start = time.perf_counter()
+    for i, h in enumerate(hashes):
+        for _, j in tree.search(h, config.distance):
+            parent[find(i)] = find(j)
+        tree.add(h, i)
+        status.update()
+    stats.record('compare', seconds=time.perf_counter() - start, files=len(hashes))
+
+    groups = {}
+    for i in range(len(hashes)):
+        root = find(i)
+        if root not in groups:
+            groups[root] = [ids[i]]
         else:
-            files.add(lowfilename)
-
+            groups[root].append(ids[i])
+    for group in groups.values():
+        if len(group) > 1:
+            print(f'Similar group {sorted(files.paths(group))}')
+
+
+def apply_main(fname):
+    """ Carry out the actions in a plan written by --pretend --plan-out, skipping stale ones. """
+    header, actions = read_plan(fname)
+    config.copy = header['copy']
+    status = Progress('Applied', enabled=config.progress)
+    # The targets of the moves and copies done so far
+    applied = set()
+    for action in actions:
+        status.update()
+        src = action['path']
+        if not is_current(action):
+            print(f"Skipping {action['action']} of {src}: it has gone or changed since the plan was made")
+            continue
+        if action['action'] == 'delete':
+            dup = action['duplicate']
+            if 'from' in dup:
+                # Its size and mtime are those of the file it was made from, and a copy
+                # doesn't keep the mtime
+                wait_for_copy(dup['path'])
+                state = file_state(dup['path'])
+                current = dup['path'] in applied and state is not None and state['size'] == dup.get('size')
+            else:
+                current = is_current(dup)
+            if not current:
+                print(f"Skipping delete of {src}: {dup['path']} has gone or changed since the plan was made")
+                continue
+            print(f"Deleting {src} which is a duplicate of {dup['path']}")
+            remove_file(src)
+            continue
+        dst = action['dst']
+        make_folder_for_file(dst)
+        if dircache.appeared(dst):
+            print(f'Rename {src} to {dst} skipped: target exists')
+            continue
+        try:
+            relocate_file(src, dst)
+            applied.add(dst)
+            print(f'Rename {src} to {dst}')
+        except Exception as e:
+            print(f'Rename {src} to {dst} failed: {e}')
+    finish_copies()
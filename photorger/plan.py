@@ -0,0 +1,80 @@
+import json
+import os
+from datetime import datetime
+
+
+PLAN_VERSION = 1
+
+
+def file_state(path):
+    """ Return the size and mtime of path, as recorded in a plan, or None if it's gone. """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+class PlanWriter:
+    """ Writes the actions a --pretend run would have taken to a file, so that apply can
+    carry them out later without walking, hashing or comparing anything again.
+
+    The file has one JSON object per line. The first describes the run, and each
+    of the others is an action: a delete, move, rename or copy of the file at path,
+    with the size and mtime it had when the plan was made. A delete also has the
+    digest of the file and the path, size and mtime of the duplicate it was found
+    to be identical to. If the duplicate is the target of an earlier action it
+    doesn't exist yet, so it has the size and mtime of the file that action
+    moves or copies there instead, and that file's path as 'from'.
+    """
+
+    def __init__(self, path, command, source, target, copy=False):
+        self.f = open(path, 'w')
+        self.count = 0
+        self.write({'plan': PLAN_VERSION, 'command': command, 'source': source, 'target': target,
+                    'copy': copy, 'created': datetime.now().isoformat()})
+
+    def write(self, entry):
+        self.f.write(json.dumps(entry) + '\n')
+
+    def add(self, action, path, dst=None, duplicate=None, digest=None, duplicate_from=None):
+        entry = {'action': action, 'path': path}
+        entry.update(file_state(path) or {})
+        if dst is not None:
+            entry['dst'] = dst
+        if digest is not None:
+            entry['digest'] = digest.hex()
+        if duplicate is not None:
+            entry['duplicate'] = {'path': duplicate}
+            if duplicate_from is not None:
+                entry['duplicate']['from'] = duplicate_from
+            entry['duplicate'].update(file_state(duplicate_from or duplicate) or {})
+        self.write(entry)
+        self.count += 1
+
+    def close(self):
+        self.f.close()
+
+
+def read_plan(path):
+    """ Return the header of the plan in path, and an iterator over its actions. """
+    f = open(path)
+    header = json.loads(f.readline() or '{}')
+    if header.get('plan') != PLAN_VERSION:
+        f.close()
+        raise ValueError(f'{path} is not a photorger plan')
+
+    def actions():
+        with f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    return header, actions()
+
+
+def is_current(entry):
+    """ Check that the file an action (or its duplicate) refers to still has the size and
+    mtime it had when the plan was made. """
+    state = file_state(entry['path'])
+    return state is not None and state['size'] == entry.get('size') and state['mtime_ns'] == entry.get('mtime_ns')
@@ -0,0 +1,168 @@
+import os
+from array import array
+
+
+class FileStore:
+    """ Compact table of file paths, for trees with millions of files.
+
+    Each file gets an integer id in the order it was added. Folder paths are kept
+    once each in a table, and the rest (the file's folder id, its name as encoded
+    bytes and its id in its folder's member list) go in flat arrays, so a file
+    costs about 16 bytes plus the length of its name instead of a string object
+    per path. Paths are only made into strings again when asked for, and
+    membership tests (`path in store`) look through the names in the path's
+    folder.
+    """
+    __slots__ = ['dirs', 'dir_ids', 'members', 'dir_of', 'names', 'name_ends', 'last_dir', 'last_names']
+
+    def __init__(self):
+        self.dirs = []
+        self.dir_ids = {}
+        self.members = []
+        self.dir_of = array('I')
+        self.names = bytearray()
+        self.name_ends = array('Q')
+        # The names in the folder looked at last, as most lookups are for the same
+        # folder as the one before
+        self.last_dir = None
+        self.last_names = None
+
+    def __len__(self):
+        return len(self.dir_of)
+
+    def dir_id(self, dpath, create=False):
+        i = self.dir_ids.get(dpath)
+        if i is None and create:
+            i = self.dir_ids[dpath] = len(self.dirs)
+            self.dirs.append(dpath)
+            self.members.append(array('I'))
+        return i
+
+    def add(self, path):
+        """ Add a file and return its id. """
+        i = path.rfind('/')
+        d = self.dir_id(path[:i], create=True)
+        name = path[i + 1:]
+        n = len(self.dir_of)
+        self.dir_of.append(d)
+        self.names += os.fsencode(name)
+        self.name_ends.append(len(self.names))
+        self.members[d].append(n)
+        if d == self.last_dir:
+            self.last_names.add(name)
+        return n
+
+    def name(self, n):
+        start = self.name_ends[n - 1] if n else 0
+        return os.fsdecode(bytes(self.names[start:self.name_ends[n]]))
+
+    def path(self, n):
+        return f'{self.dirs[self.dir_of[n]]}/{self.name(n)}'
+
+    def paths(self, ids):
+        return [self.path(n) for n in ids]
+
+    def __contains__(self, path):
+        i = path.rfind('/')
+        d = self.dir_ids.get(path[:i])
+        if d is None:
+            return False
+        if d != self.last_dir:
+            self.last_dir = d
+            self.last_names = {self.name(n) for n in self.members[d]}
+        return path[i + 1:] in self.last_names
+
+
+# Multiplier for Fibonacci hashing of sizes into SizeTable's index, so that sizes
+# that are all multiples of some block size still spread out.
+FIB = 0x9E3779B97F4A7C15
+MASK64 = (1 << 64) - 1
+
+
+class SizeTable:
+    """ Map from file size to the ids of the files of that size, in the order they were
+    added.
+
+    In a photo library nearly every file has a size of its own, and a dict entry
+    with int objects for the key and value costs around 100 bytes, so this is a
+    hash table built from flat arrays instead. Each size gets a row in keys,
+    firsts, lasts and counts (in the order sizes were first added); index is an
+    open addressing table of row numbers, and the ids of the files with the same
+    size are chained through next, which is indexed by id. That comes to about 30
+    bytes per file.
+    """
+    __slots__ = ['index', 'shift', 'keys', 'firsts', 'lasts', 'counts', 'next']
+
+    def __init__(self):
+        self.index = array('i', [-1]) * 8
+        self.shift = 64 - 3
+        self.keys = array('q')
+        self.firsts = array('I')
+        self.lasts = array('I')
+        self.counts = array('I')
+        self.next = array('I')
+
+    def slot(self, size):
+        """ Return the slot in index that has size's row, or the empty one it would go in. """
+        index = self.index
+        keys = self.keys
+        mask = len(index) - 1
+        i = ((size * FIB) & MASK64) >> self.shift
+        while True:
+            k = index[i]
+            if k < 0 or keys[k] == size:
+                return i
+            i = (i + 1) & mask
+
+    def row(self, size):
+        return self.index[self.slot(size)]
+
+    def add(self, size, n):
+        """ Add file id n under size, and return how many files now have that size. """
+        nxt = self.next
+        if n >= len(nxt):
+            nxt.extend(array('I', [0]) * (n + 1 - len(nxt)))
+        i = self.slot(size)
+        k = self.index[i]
+        if k >= 0:
+            nxt[self.lasts[k]] = n
+            self.lasts[k] = n
+            count = self.counts[k] + 1
+            self.counts[k] = count
+            return count
+        self.index[i] = len(self.keys)
+        self.keys.append(size)
+        self.firsts.append(n)
+        self.lasts.append(n)
+        self.counts.append(1)
+        # Keep the index at most two thirds full so probe sequences stay short
+        if 3 * len(self.keys) > 2 * len(self.index):
+            self.grow()
+        return 1
+
+    def grow(self):
+        self.index = array('i', [-1]) * (2 * len(self.index))
+        self.shift -= 1
+        for k, size in enumerate(self.keys):
+            self.index[self.slot(size)] = k
+
+    def get(self, size):
+        k = self.row(size)
+        if k < 0:
+            return []
+        n = self.firsts[k]
+        ids = [n]
+        for _ in range(self.counts[k] - 1):
+            n = self.next[n]
+            ids.append(n)
+        return ids
+
+    def count(self, size):
+        k = self.row(size)
+        return self.counts[k] if k >= 0 else 0
+
+    def __contains__(self, size):
+        return self.row(size) >= 0
+
+    def __iter__(self):
+        return iter(self.keys)
@@ -0,0 +1,116 @@
+import json
+import sys
+import threading
+import time
+from datetime import timedelta
+
+
+PHASES = ['walk', 'metadata', 'hash', 'compare', 'relocate']
+
+
+class PhaseStats:
+    __slots__ = ['seconds', 'files', 'bytes_read', 'bytes_written', 'hits', 'misses']
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.files = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.hits = 0
+        self.misses = 0
+
+    def as_dict(self):
+        d = {name: getattr(self, name) for name in self.__slots__}
+        lookups = self.hits + self.misses
+        d['hit_rate'] = self.hits / lookups if lookups else None
+        return d
+
+
+class Stats:
+    """ Counters and timings for each phase of a run.
+
+    Phase times are the sum of the time spent in each call, so when several
+    threads work on a phase at once its time can exceed the wall time.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phases = {phase: PhaseStats() for phase in PHASES}
+        self.start = time.perf_counter()
+
+    def record(self, phase, seconds=0.0, files=0, bytes_read=0, bytes_written=0):
+        with self.lock:
+            p = self.phases[phase]
+            p.seconds += seconds
+            p.files += files
+            p.bytes_read += bytes_read
+            p.bytes_written += bytes_written
+
+    def cache_lookup(self, phase, hit):
+        with self.lock:
+            if hit:
+                self.phases[phase].hits += 1
+            else:
+                self.phases[phase].misses += 1
+
+    def timed_iter(self, phase, items):
+        """ Yield from items, counting each item as a file and the time spent producing it. """
+        it = iter(items)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                self.record(phase, seconds=time.perf_counter() - start)
+                return
+            self.record(phase, seconds=time.perf_counter() - start, files=1)
+            yield item
+
+    def summary(self):
+        return {
+            'wall_seconds': time.perf_counter() - self.start,
+            'phases': {phase: p.as_dict() for phase, p in self.phases.items()},
+        }
+
+    def report(self, fmt, out):
+        summary = self.summary()
+        if fmt == 'json':
+            json.dump(summary, out, indent=2)
+            out.write('\n')
+            return
+        out.write(f"{'phase':10s} {'seconds':>9s} {'files':>9s} {'MB read':>10s} {'MB written':>10s} {'cache hits':>10s}\n")
+        for phase, p in summary['phases'].items():
+            hit_rate = '' if p['hit_rate'] is None else f"{100 * p['hit_rate']:.1f}%"
+            out.write(f"{phase:10s} {p['seconds']:9.2f} {p['files']:9d} {p['bytes_read'] / 1e6:10.1f} "
+                      f"{p['bytes_written'] / 1e6:10.1f} {hit_rate:>10s}\n")
+        out.write(f"Total wall time {summary['wall_seconds']:.2f} seconds\n")
+
+
+class Progress:
+    """ Prints a line to stderr at most every interval seconds saying how far a phase has got. """
+
+    def __init__(self, label, total=None, enabled=True, interval=10):
+        self.label = label
+        self.total = total
+        self.enabled = enabled
+        self.interval = interval
+        self.count = 0
+        self.start = self.last = time.perf_counter()
+
+    def update(self, n=1):
+        self.count += n
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        if now - self.last < self.interval:
+            return
+        self.last = now
+        rate = self.count / (now - self.start)
+        line = f'{self.label}: {self.count}'
+        if self.total:
+            line += f' of {self.total} ({100 * self.count / self.total:.0f}%)'
+        line += f', {rate:.0f}/sec'
+        if self.total and rate:
+            eta = timedelta(seconds=int((self.total - self.count) / rate))
+            line += f', ETA {eta}'
+        print(line, file=sys.stderr)
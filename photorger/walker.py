@@ -0,0 +1,87 @@
+import os
+from collections import deque, namedtuple
+
+
+FileRecord = namedtuple('FileRecord', ['path', 'size', 'mtime_ns', 'inode'])
+
+
+def read_folder(dpath, recursive=True, exclude=(), prune=()):
+    """ Read dpath with a single scandir, and return (names, files, subdirs): the names of
+    everything in it, the DirEntry of each file, and the paths of the subfolders to
+    descend into. Hidden files and folders are left out of files and subdirs (but
+    not names), as are folders named in exclude or whose full path is in prune.
+    """
+    names = []
+    files = []
+    subdirs = []
+    with os.scandir(dpath) as it:
+        for entry in it:
+            name = entry.name
+            names.append(name)
+            if name[0] == '.':
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive and name not in exclude and entry.path not in prune:
+                        subdirs.append(entry.path)
+                elif entry.is_file():
+                    files.append(entry)
+            except OSError:
+                continue  # Vanished or unreadable; skip it
+    return names, files, subdirs
+
+
+def walk_files(root, recursive=True, exclude=(), prune=(), on_dir=None):
+    """ Yield a FileRecord for every file under root, using one scandir per folder.
+
+    Hidden files and folders are skipped, as are folders named in exclude and
+    folders whose full path is in prune; none of these are descended into.
+    on_dir, if given, is called with the path of each folder before it is read.
+    Symbolic links to folders are not followed.
+    """
+    if root in prune:
+        return
+    stack = [root]
+    while stack:
+        dpath = stack.pop()
+        if on_dir and dpath != root:
+            on_dir(dpath)
+        try:
+            _, files, subdirs = read_folder(dpath, recursive, exclude, prune)
+        except OSError as e:
+            print(f"Can't read folder {dpath}: {e}")
+            continue
+        for entry in files:
+            try:
+                st = entry.stat()
+            except OSError:
+                continue  # Vanished since the scandir
+            yield FileRecord(entry.path, st.st_size, st.st_mtime_ns, st.st_ino)
+        # Visit subfolders in the order they were listed
+        stack.extend(reversed(subdirs))
+
+
+def walk_folders(root, recursive=True, exclude=(), jobs=1):
+    """ Yield (path, names, files) for each folder under root, as returned by read_folder,
+    skipping the same things as walk_files.
+
+    Up to jobs folders are read at the same time in threads, and a few more than
+    that are read ahead, so memory use depends on the size of the largest folders
+    rather than the size of the tree. Folders are yielded in breadth-first order.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        todo = deque([root])
+        pending = deque()
+        while todo or pending:
+            while todo and len(pending) < 2 * max(jobs, 1):
+                dpath = todo.popleft()
+                pending.append((dpath, executor.submit(read_folder, dpath, recursive, exclude)))
+            dpath, future = pending.popleft()
+            try:
+                names, files, subdirs = future.result()
+            except OSError as e:
+                print(f"Can't read folder {dpath}: {e}")
+                continue
+            todo.extend(subdirs)
+            yield dpath, names, files
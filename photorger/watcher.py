@@ -0,0 +1,120 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+from .walker import read_folder
+
+try:
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    libc.inotify_init1
+except (OSError, AttributeError):  # Not on Linux
+    libc = None
+
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+EVENT = struct.Struct('iIII')
+
+
+class Watcher:
+    """ Reports files under root that may have been created or changed, using inotify.
+    rescan is set when events may have been missed (or there's no inotify), and
+    writing has the files that have been created but not yet closed. """
+
+    def __init__(self, root, recursive=True, exclude=()):
+        self.recursive = recursive
+        self.exclude = exclude
+        self.folders = {}
+        self.writing = set()
+        self.rescan = False
+        self.fd = None
+        if libc is not None:
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd >= 0:
+                self.fd = fd
+        if self.fd is None:
+            self.rescan = True
+        else:
+            self.watch_tree(root)
+
+    def watch_tree(self, root):
+        """ Watch root and the folders under it, and return the paths of the files in them,
+        as they may have been created before the watches were in place. """
+        files = []
+        todo = [root]
+        while todo:
+            dpath = todo.pop()
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(dpath), WATCH_MASK)
+            if wd < 0:
+                # Most likely out of watches (see fs.inotify.max_user_watches)
+                print(f"Can't watch folder {dpath}: {os.strerror(ctypes.get_errno())}")
+                self.rescan = True
+                continue
+            self.folders[wd] = dpath
+            try:
+                _, entries, subdirs = read_folder(dpath, self.recursive, self.exclude)
+            except OSError:
+                continue
+            files.extend(entry.path for entry in entries)
+            todo.extend(subdirs)
+        return files
+
+    def changes(self, timeout):
+        """ Wait up to timeout seconds for changes, and return the paths of the files that
+        were created, written or moved in. """
+        if self.fd is None:
+            time.sleep(max(timeout, 0))
+            return []
+        ready, _, _ = select.select([self.fd], [], [], max(timeout, 0))
+        if not ready:
+            return []
+        paths = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, length = EVENT.unpack_from(data, pos)
+                name = os.fsdecode(data[pos + EVENT.size:pos + EVENT.size + length].rstrip(b'\0'))
+                pos += EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    self.rescan = True
+                    continue
+                dpath = self.folders.get(wd)
+                if mask & IN_IGNORED:
+                    self.folders.pop(wd, None)
+                if dpath is None or not name or name[0] == '.':
+                    continue
+                path = f'{dpath}/{name}'
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO) and self.recursive and name not in self.exclude:
+                        paths.extend(self.watch_tree(path))
+                else:
+                    if mask & IN_CREATE:
+                        self.writing.add(path)
+                    else:
+                        self.writing.discard(path)
+                    paths.append(path)
+        return paths
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
@@ -0,0 +1,35 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from generate import exif_jpeg_header  # noqa: E402
+
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def photo(created, body=b''):
+    """ Return the bytes of a JPEG-like file with created as its EXIF date. """
+    return exif_jpeg_header(created) + body + b'\xff\xd9'
+
+
+@pytest.fixture
+def photorger():
+    """ Run the photorger command line in a new process, as it would be from cron, and
+    return its output. """
+    def run(*args):
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        return subprocess.run([sys.executable, '-m', 'photorger.cli', *args], env=env, check=True,
+                              capture_output=True, text=True).stdout
+    return run
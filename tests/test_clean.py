@@ -0,0 +1,47 @@
+import os
+
+from conftest import write_file
+
+
+def test_dest_inside_source_is_not_a_duplicate_of_itself(photorger, tmp_path):
+    source = tmp_path / 's'
+    write_file(source / 'sub' / 'f.txt', b'only copy')
+    write_file(source / 'other.txt', b'something else')
+
+    output = photorger('clean', f'--source={source}', f'--dest={source}/sub')
+
+    assert 'Deleting' not in output
+    assert (source / 'sub' / 'f.txt').read_bytes() == b'only copy'
+
+
+def test_dest_inside_source_keeps_source_dups_of_dest_files(photorger, tmp_path):
+    # Files under the dest folder are also in the source walk, but can't justify
+    # deleting each other
+    source = tmp_path / 's'
+    write_file(source / 'sub' / 'a.txt', b'same')
+    write_file(source / 'sub' / 'b.txt', b'same')
+
+    photorger('clean', f'--source={source}', f'--dest={source}/sub')
+
+    assert (source / 'sub' / 'a.txt').exists() and (source / 'sub' / 'b.txt').exists()
+
+
+def test_source_dup_of_dest_file_is_deleted(photorger, tmp_path):
+    write_file(tmp_path / 'src' / 'x.txt', b'photo')
+    write_file(tmp_path / 'lib' / 'y.txt', b'photo')
+
+    output = photorger('clean', f'--source={tmp_path}/src', f'--dest={tmp_path}/lib')
+
+    assert f'Deleting {tmp_path}/src/x.txt which is a duplicate of {tmp_path}/lib/y.txt' in output
+    assert not (tmp_path / 'src' / 'x.txt').exists()
+    assert (tmp_path / 'lib' / 'y.txt').exists()
+
+
+def test_pretend_writes_nothing(photorger, tmp_path):
+    write_file(tmp_path / 'a.txt', b'same')
+    write_file(tmp_path / 'b.txt', b'same')
+
+    output = photorger('clean', '--pretend', '--force', f'--source={tmp_path}')
+
+    assert 'Force deleting' in output
+    assert sorted(os.listdir(tmp_path)) == ['a.txt', 'b.txt']
@@ -0,0 +1,64 @@
+import pytest
+
+from conftest import write_file
+from photorger import photorger
+from photorger.config import Config
+
+
+@pytest.fixture
+def config(monkeypatch):
+    config = Config()
+    monkeypatch.setattr(photorger, 'config', config)
+    monkeypatch.setattr(photorger, 'iosched', None)
+    return config
+
+
+@pytest.fixture
+def files(tmp_path):
+    """ Write files with the given contents, and return their paths. """
+    def make(*contents):
+        paths = []
+        for i, data in enumerate(contents):
+            path = tmp_path / f'{i}.bin'
+            write_file(path, data)
+            paths.append(str(path))
+        return paths
+    return make
+
+
+def test_lockstep_partition_splits_late_differences(config, files):
+    # Same first blocks, different last block
+    head = bytes(range(256)) * (3 * photorger.BUF_SIZE // 256)
+    a, b, c, d, e, f = files(head + b'x', head + b'y', head + b'x', b'z', b'', b'')
+
+    classes = photorger.lockstep_partition([a, b, c, d, e, f])
+
+    assert classes == [[a, c], [b], [d], [e, f]]
+
+
+def test_split_identical_drops_singletons(config, files):
+    a, b, c, d = files(b'same', b'other', b'same', b'alone')
+
+    assert photorger.split_identical([a, b, c, d]) == [[a, c]]
+    assert photorger.split_identical([b, d]) == []
+
+
+def test_split_identical_merges_chunks(config, files, monkeypatch):
+    monkeypatch.setattr(photorger, 'MAX_OPEN_FILES', 3)
+    paths = files(b'a', b'b', b'a', b'c', b'b', b'd', b'a', b'c', b'e')
+
+    groups = photorger.split_identical(paths)
+
+    assert groups == [[paths[0], paths[2], paths[6]], [paths[1], paths[4]], [paths[3], paths[7]]]
+
+
+def test_split_identical_shares_open_files_between_jobs(config, files, monkeypatch):
+    sizes = []
+    partition = photorger.lockstep_partition
+    monkeypatch.setattr(photorger, 'lockstep_partition', lambda chunk: sizes.append(len(chunk)) or partition(chunk))
+    monkeypatch.setattr(photorger, 'MAX_OPEN_FILES', 16)
+    config.jobs = 4
+    paths = files(*[b'same'] * 10)
+
+    assert photorger.split_identical(paths) == [paths]
+    assert max(sizes) == 4
@@ -0,0 +1,66 @@
+import random
+import re
+from datetime import datetime
+
+from photorger.dates import date_from_name, date_from_path, infer_dates
+
+# The whole-path patterns date_from_path replaced
+path_re1 = re.compile('^(.*)/([12][90][01289][0-9])/([01][0-9])/([0123][0-9])/(.*)$')
+path_re2 = re.compile('^(.*)/([12][90][01289][0-9])/([01][0-9])/(.*)$')
+path_re3 = re.compile('^(.*)/([12][90][01289][0-9])/(.*)$')
+
+
+def old_date_from_path(fname):
+    m = path_re1.match(fname)
+    if m:
+        return int(m.group(2)), int(m.group(3)), int(m.group(4)), m.group(5)
+    m = path_re2.match(fname)
+    if m:
+        return int(m.group(2)), int(m.group(3)), 0, m.group(4)
+    m = path_re3.match(fname)
+    if m:
+        return int(m.group(2)), 0, 0, m.group(3)
+    return 0, 0, 0, fname
+
+
+def test_date_from_path_matches_old_patterns():
+    rng = random.Random(1)
+    parts = ['2017', '1999', '2093', '3017', '201', '20170', '01', '12', '13', '31', '40', '1',
+             'photos', 'x', '', 'IMG_1.JPG', '2017-01-05']
+    for _ in range(20000):
+        fname = '/' + '/'.join(rng.choice(parts) for _ in range(rng.randrange(1, 8))) + '/' + rng.choice(parts)
+        assert date_from_path(fname) == old_date_from_path(fname), fname
+
+
+def test_date_from_path_prefers_innermost_full_dates():
+    assert date_from_path('/p/2015/01/02/2016/03/x.jpg') == (2015, 1, 2, '2016/03/x.jpg')
+    assert date_from_path('/p/2015/01/02/2016/03/04/x.jpg') == (2016, 3, 4, 'x.jpg')
+    assert date_from_path('/p/2015/01/02/a/x.jpg') == (2015, 1, 2, 'a/x.jpg')
+    assert date_from_path('/p/a/x.jpg') == (0, 0, 0, '/p/a/x.jpg')
+    assert infer_dates(['/p/2015/x.jpg', '/p/y.jpg']) == {'/p/2015/x.jpg': (2015, 0, 0, 'x.jpg'),
+                                                          '/p/y.jpg': (0, 0, 0, '/p/y.jpg')}
+
+
+def test_date_from_name():
+    assert date_from_name('/in/IMG_20170116_1234.jpg') == datetime(2017, 1, 16)
+    assert date_from_name('/in/2017-01-16 party.jpg') == datetime(2017, 1, 16)
+    assert date_from_name('/in/3 Sep 2015 clip.mp4') == datetime(2015, 9, 3)
+    assert date_from_name('/in/January 16, 2007.mov') == datetime(2007, 1, 16)
+    assert date_from_name('/in/16 jan, 2007.mov') == datetime(2007, 1, 16)
+
+
+def test_date_from_name_skips_invalid_dates():
+    assert date_from_name('/in/20171301.jpg') is None
+    assert date_from_name('/in/IMG_20170231_20170301.jpg') == datetime(2017, 3, 1)
+    assert date_from_name('/in/32 Jan 2017.jpg') is None
+    assert date_from_name('/in/Foo 5, 2017.jpg') is None
+    assert date_from_name('/in/120170116.jpg') is None
+
+
+def test_date_from_name_retries_overlapping_candidates():
+    # "Foo 12 2017" is found first, but Foo isn't a month
+    assert date_from_name('/in/Foo 12 2017-01-05.jpg') == datetime(2017, 1, 5)
+
+
+def test_date_from_name_only_looks_at_the_base_name():
+    assert date_from_name('/in/2017-01-05/IMG_1.jpg') is None
@@ -0,0 +1,47 @@
+import os
+
+from conftest import write_file
+from photorger.dircache import DirCache
+
+
+def test_distinct_name_resumes_after_returned_suffixes(tmp_path):
+    write_file(tmp_path / 'IMG.JPG', b'')
+    write_file(tmp_path / 'IMG(1).JPG', b'')
+    cache = DirCache()
+
+    assert cache.distinct_name(f'{tmp_path}/IMG.JPG') == f'{tmp_path}/IMG(2).JPG'
+    assert cache.distinct_name(f'{tmp_path}/IMG.JPG') == f'{tmp_path}/IMG(3).JPG'
+    cache.add(f'{tmp_path}/IMG(4).JPG')
+    assert cache.distinct_name(f'{tmp_path}/IMG.JPG') == f'{tmp_path}/IMG(5).JPG'
+    assert cache.distinct_name(f'{tmp_path}/Other.JPG') == f'{tmp_path}/Other(1).JPG'
+
+
+def test_distinct_name_without_extension(tmp_path):
+    write_file(tmp_path / 'README', b'')
+    write_file(tmp_path / '.hidden', b'')
+    cache = DirCache()
+
+    assert cache.distinct_name(f'{tmp_path}/README') == f'{tmp_path}/README(1)'
+    assert cache.distinct_name(f'{tmp_path}/.hidden') == f'{tmp_path}/.hidden(1)'
+    assert cache.distinct_name(f'{tmp_path}/new/a.b.c') == f'{tmp_path}/new/a.b(1).c'
+
+
+def test_distinct_name_nocase(tmp_path):
+    write_file(tmp_path / 'img(1).jpg', b'')
+    cache = DirCache()
+
+    assert cache.distinct_name(f'{tmp_path}/IMG.JPG') == f'{tmp_path}/IMG(1).JPG'
+    assert cache.distinct_name(f'{tmp_path}/IMG.JPG', nocase=True) == f'{tmp_path}/IMG(2).JPG'
+
+
+def test_unreadable_folder_is_not_cached(tmp_path, monkeypatch):
+    write_file(tmp_path / 'a.jpg', b'')
+    cache = DirCache()
+
+    def scandir(path):
+        raise PermissionError(13, 'Permission denied', path)
+
+    with monkeypatch.context() as m:
+        m.setattr(os, 'scandir', scandir)
+        assert not cache.exists(f'{tmp_path}/a.jpg')
+    assert cache.exists(f'{tmp_path}/a.jpg')
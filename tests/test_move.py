@@ -0,0 +1,53 @@
+import os
+from datetime import datetime
+
+from conftest import photo, write_file
+
+
+def test_dest_inside_source_is_not_a_duplicate_of_itself(photorger, tmp_path):
+    data = photo(datetime(2015, 12, 29, 9, 55, 52), b'only copy')
+    write_file(tmp_path / 'lib' / 'misc' / 'IMG.JPG', data)
+
+    output = photorger('move', f'--source={tmp_path}', f'--dest={tmp_path}/lib')
+
+    assert 'duplicate' not in output
+    assert (tmp_path / 'lib' / '2015' / '12' / '29' / 'IMG.JPG').read_bytes() == data
+
+
+def test_source_dup_of_dest_file_is_removed(photorger, tmp_path):
+    data = photo(datetime(2015, 12, 29, 9, 55, 52), b'photo')
+    write_file(tmp_path / 'lib' / 'misc' / 'IMG.JPG', data)
+    write_file(tmp_path / 'in' / 'IMG_1.JPG', data)
+
+    output = photorger('move', f'--source={tmp_path}/in', f'--dest={tmp_path}/lib')
+
+    assert f'{tmp_path}/lib/misc/IMG.JPG is a duplicate; removing source' in output
+    assert not (tmp_path / 'in' / 'IMG_1.JPG').exists()
+    assert (tmp_path / 'lib' / 'misc' / 'IMG.JPG').exists()
+
+
+def test_dup_of_file_still_being_copied_is_found(photorger, tmp_path):
+    # Big enough, with --io-rate, that the first copy is still running when the second
+    # file is checked
+    data = photo(datetime(2015, 1, 2, 3, 4, 5), os.urandom(1 << 20))
+    write_file(tmp_path / 'in' / 'A.JPG', data)
+    write_file(tmp_path / 'in' / 'B.JPG', data)
+    os.mkdir(tmp_path / 'lib')
+
+    output = photorger('move', '--copy', '--copy-jobs=2', '--io-rate=2',
+                       f'--source={tmp_path}/in', f'--dest={tmp_path}/lib')
+
+    assert 'is a duplicate' in output
+    assert len(os.listdir(tmp_path / 'lib' / '2015' / '01' / '02')) == 1
+
+
+def test_source_same_as_dest_finds_duplicates(photorger, tmp_path):
+    data = photo(datetime(2019, 5, 6, 7, 8, 9), b'keep')
+    write_file(tmp_path / '2019' / '05' / '06' / 'KEEP.JPG', data)
+    write_file(tmp_path / 'inbox' / 'IMG_9.JPG', data)
+
+    output = photorger('move', f'--source={tmp_path}', f'--dest={tmp_path}')
+
+    assert f'{tmp_path}/2019/05/06/KEEP.JPG is a duplicate; removing source' in output
+    assert not (tmp_path / 'inbox' / 'IMG_9.JPG').exists()
+    assert os.listdir(tmp_path / '2019' / '05' / '06') == ['KEEP.JPG']
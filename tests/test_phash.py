@@ -0,0 +1,52 @@
+import random
+
+import pytest
+
+from photorger import phash
+from photorger.bktree import BKTree
+from photorger.hashindex import HashIndex
+
+
+def random_pixels(rng):
+    return bytes(rng.randrange(256) for _ in range(phash.HASH_SIZE * (phash.HASH_SIZE + 1)))
+
+
+def test_dhash_batch_matches_dhash():
+    pytest.importorskip('numpy')
+    rng = random.Random(1)
+    batch = [random_pixels(rng) for _ in range(100)] + [bytes(72), bytes(range(72)), bytes(range(72, 0, -1))]
+
+    assert phash.dhash_batch(batch) == [phash.dhash(pixels) for pixels in batch]
+
+
+def test_dhash_bits():
+    assert phash.dhash(bytes(range(72))) == (1 << 64) - 1
+    assert phash.dhash(bytes(72)) == 0
+
+
+def test_bktree_search_matches_brute_force():
+    rng = random.Random(2)
+    centres = [rng.getrandbits(64) for _ in range(20)]
+    # Clusters of hashes a few bits apart, plus repeats, as similar images give
+    hashes = [c ^ sum(1 << rng.randrange(64) for _ in range(rng.randrange(6))) for c in centres for _ in range(30)]
+    hashes += hashes[:50]
+    tree = BKTree()
+    for i, h in enumerate(hashes):
+        tree.add(h, i)
+
+    for h in hashes[::7] + [rng.getrandbits(64) for _ in range(20)]:
+        for radius in [0, 3, 6, 12]:
+            expected = sorted((phash.hamming(h, h2), i) for i, h2 in enumerate(hashes)
+                              if phash.hamming(h, h2) <= radius)
+            assert sorted(tree.search(h, radius)) == expected
+
+
+def test_phash_index_round_trip(tmp_path):
+    index = HashIndex(str(tmp_path / 'index'))
+    index.store_phash('/a.jpg', 10, 20, (1 << 64) - 1)
+    index.store_phash('/b.jpg', 10, 20, -1)
+
+    assert index.lookup_phash('/a.jpg', 10, 20) == (1 << 64) - 1
+    assert index.lookup_phash('/b.jpg', 10, 20) == -1
+    assert index.lookup_phash('/a.jpg', 10, 21) is None
+    index.close()
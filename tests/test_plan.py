@@ -0,0 +1,26 @@
+import os
+from datetime import datetime
+
+from conftest import photo, write_file
+
+
+def test_apply_matches_a_real_run(photorger, tmp_path):
+    created = datetime(2015, 12, 29, 9, 55, 52)
+    first, second = photo(created, b'first'), photo(created, b'second')
+    # Two different files that would be moved to the same name, and a duplicate of each
+    write_file(tmp_path / 'in' / 'a' / 'IMG.JPG', first)
+    write_file(tmp_path / 'in' / 'b' / 'IMG.JPG', second)
+    write_file(tmp_path / 'in' / 'c' / 'IMG_1.JPG', first)
+    write_file(tmp_path / 'in' / 'd' / 'IMG_2.JPG', second)
+    os.mkdir(tmp_path / 'lib')
+    plan = tmp_path / 'plan.jsonl'
+
+    photorger('move', '--pretend', f'--plan-out={plan}',
+              f'--source={tmp_path}/in', f'--dest={tmp_path}/lib')
+    output = photorger('apply', str(plan))
+
+    assert 'Skipping' not in output
+    assert 'skipped' not in output
+    folder = tmp_path / 'lib' / '2015' / '12' / '29'
+    assert sorted(f.read_bytes() for f in folder.iterdir()) == sorted([first, second])
+    assert not any(files for _, _, files in os.walk(tmp_path / 'in'))
@@ -0,0 +1,73 @@
+import random
+
+from photorger.records import FileStore, SizeTable
+
+
+def test_size_table_matches_dict():
+    rng = random.Random(1)
+    table = SizeTable()
+    expected = {}
+    # Enough sizes to grow the index several times, with some repeated, some
+    # multiples of a block size and some beyond 32 bits
+    sizes = [rng.choice([rng.randrange(1000), rng.randrange(1 << 40), 4096 * rng.randrange(100)])
+             for _ in range(5000)]
+    for n, size in enumerate(sizes):
+        assert table.add(size, n) == len(expected.setdefault(size, [])) + 1
+        expected[size].append(n)
+    assert len(table.index) >= 8 << 8  # Grown at least eight times
+    for size, ids in expected.items():
+        assert table.get(size) == ids
+        assert table.count(size) == len(ids)
+        assert size in table
+    assert list(table) == list(expected)
+    for size in [-1, 1 << 41, 4096 * 101]:
+        assert size not in table
+        assert table.get(size) == []
+        assert table.count(size) == 0
+
+
+def test_size_table_ids_out_of_order():
+    table = SizeTable()
+    table.add(10, 7)
+    table.add(20, 2)
+    table.add(10, 0)
+    table.add(10, 12)
+    table.add(20, 5)
+
+    assert table.get(10) == [7, 0, 12]
+    assert table.get(20) == [2, 5]
+    assert len(table.next) == 13
+
+
+def test_file_store_round_trips_paths():
+    store = FileStore()
+    paths = ['/photos/2019/05/06/IMG_1.JPG', '/photos/Ümläut/Café.jpg', '/photos/日本/写真.png',
+             '/photos/2019/05/06/IMG_2.JPG', '/photos/bad/\udcff.jpg', '/photos/Ümläut/naïve.jpg']
+    ids = [store.add(path) for path in paths]
+
+    assert ids == list(range(len(paths)))
+    assert len(store) == len(paths)
+    assert store.paths(ids) == paths
+    assert store.paths(reversed(ids)) == paths[::-1]
+    assert store.name(2) == '写真.png'
+    for path in paths:
+        assert path in store
+    assert '/photos/Ümläut/cafe.jpg' not in store
+    assert '/elsewhere/Café.jpg' not in store
+
+
+def test_file_store_contains_sees_adds_to_cached_folder():
+    store = FileStore()
+    store.add('/a/x.jpg')
+    assert '/a/x.jpg' in store
+    assert '/a/y.jpg' not in store  # Caches the names in /a
+
+    store.add('/a/y.jpg')
+    store.add('/b/z.jpg')
+
+    assert '/a/y.jpg' in store
+    assert '/b/z.jpg' in store
+    assert '/a/z.jpg' not in store
+    store.add('/a/z.jpg')
+    assert '/b/z.jpg' in store
+    assert '/a/z.jpg' in store